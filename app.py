@@ -1,18 +1,30 @@
 # PYTHON MODULES
-import os, ast
+import os, ast, io, json, time, hashlib, logging
+from calendar import Calendar
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
+from functools import wraps
+
+import click
 
 # FLASK MODULES
-from flask import Flask, redirect, render_template, request, flash, session, g, abort, jsonify
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Flask, Blueprint, redirect, render_template, request, flash, session, g, abort,
+                   jsonify, Response, stream_with_context, make_response, current_app)
 from sqlalchemy.exc import IntegrityError   # for already taken usernames
 
-# SPECIAL MODULES
-from fatsecret import Fatsecret
-
 # MY MODULES
+import assets
+import compression
+import metrics
+from config import config_from_env, CONFIGS
+from fragments import fragment_cache
+from importer import import_logs, file_format
+from jobs import run_worker, HANDLERS, POLL_INTERVAL
+from exporter import export_rows, columnar_export, EXPORT_FORMATS
 from forms import UserAddForm, LoginForm
-from models import db, connect_db, Food, FoodServing, FoodLog, User
+from models import (db, connect_db, Food, FoodServing, FoodLog, User, UserFood, DailyTotal, Job, as_list,
+                    ensure_food_log_partitions, add_months, PARTITION_MONTHS_AHEAD,
+                    USER_FOODS_TRIGGERS, DAILY_TOTALS_TRIGGERS)
 
 # SENSITIVE DATA MANAGEMENT
 try:
@@ -27,29 +39,13 @@ except:
 CURR_USER_KEY = "curr_user"
 DATE_KEY = "the_date"
 FOOD_KEY = "food"
+CART_KEY = "cart"
+LAST_WRITE_KEY = "last_write"
 
-app = Flask(__name__)
-
-# DATABASE CONNECTION
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    os.environ.get(
-        "DATABASE_URL",    # IF THERE IS AN ENV_VAR
-        "postgresql:///calorie_db"   # LOCAL VAR
-    )
-)
-
-# HEROKU POSTGRESQL ADDRESS FIX
-app.config["SQLALCHEMY_DATABASE_URI"] = app.config["SQLALCHEMY_DATABASE_URI"].replace("postgres://", "postgresql://", 1)
+logger = logging.getLogger(__name__)
 
-# OTHER CONFIGURATIONS
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ECHO"] = False   # SWITCHED
-app.config["DEBUG_TB_INTERCEPT_REDIRECTS"] = False
-# app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", API_SECRET_KEY)
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "top_secret")
-toolbar = DebugToolbarExtension(app)
-
-connect_db(app)
+# ROUTES, HOOKS & COMMANDS OF THE APP; create_app() REGISTERS THEM
+bp = Blueprint('main', __name__, cli_group=None)
 
 CONSUMER_KEY = os.environ.get(
     "CONSUMER_KEY",   # REMOTE
@@ -61,17 +57,82 @@ CONSUMER_SECRET = os.environ.get(
     CONSUMER_SECRET      # LOCAL
 )
 
-fs = Fatsecret(CONSUMER_KEY, CONSUMER_SECRET)
-# BASE_URL = "https://platform.fatsecret.com/rest/server.api"
+_fatsecret = None
+
+
+def new_fatsecret():
+    """A new Fatsecret client (the module is imported on first use, so the
+    web workers start without importing & setting up its OAuth1 service)."""
+
+    from fatsecret import Fatsecret
+
+    # BASE_URL = "https://platform.fatsecret.com/rest/server.api"
+    return Fatsecret(CONSUMER_KEY, CONSUMER_SECRET)
+
+
+def get_fatsecret():
+    """The shared Fatsecret client, built on first use."""
+
+    global _fatsecret
+
+    if _fatsecret is None:
+        _fatsecret = new_fatsecret()
+
+    return _fatsecret
+
+# PARALLEL FATSECRET CALLS WHEN A CART IS LOGGED
+API_WORKERS = 4
+
+# LOCAL CATALOG FOODS REFRESHED WITHIN THIS TIME ARE SHOWN WITHOUT AN API CALL
+CATALOG_MAX_AGE = timedelta(days=int(os.environ.get('CATALOG_MAX_AGE_DAYS', 30)))
+
+# RESULTS PER SEARCH PAGE
+SEARCH_PAGE_SIZE = 20
+
+# RENDERED SEARCH RESULT PAGES ARE KEPT FOR SEARCH_CACHE_SECONDS, IN AT MOST
+# SEARCH_CACHE_BYTES OF EACH WORKER'S MEMORY
+search_cache = fragment_cache(
+    'search',
+    ttl=int(os.environ.get('SEARCH_CACHE_SECONDS', 600)),
+    max_bytes=int(os.environ.get('SEARCH_CACHE_BYTES', 8 * 1024 * 1024))
+)
 
 # db.drop_all()
 # db.create_all()
 
 
+##################################################################
+# Database maintenance
+
+@bp.before_app_first_request
+def create_partitions():
+    """Keep the food_logs partitions of the coming months ready."""
+
+    if not current_app.config["PARTITIONS_ON_FIRST_REQUEST"]:
+        return
+
+    with db.engine.begin() as connection:
+        ensure_food_log_partitions(connection)
+
+
+@bp.cli.command('partitions')
+@click.option('--ahead', default=PARTITION_MONTHS_AHEAD,
+              help='Months to create ahead of the current one.')
+def partitions_command(ahead):
+    """Create the monthly food_logs partitions ahead of time."""
+
+    last = add_months(date.today(), ahead)
+
+    with db.engine.begin() as connection:
+        created = ensure_food_log_partitions(connection, last=last)
+
+    click.echo(f"Created {len(created)} partition(s): {', '.join(created)}")
+
+
 ##################################################################
 # User signup/login/logout
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr_user to Flask global."""
 
@@ -81,6 +142,48 @@ def add_user_to_g():
         g.user = None
     
 
+@bp.after_app_request
+def remember_write(response):
+    """Note the time of the user's last write for replica stickiness."""
+
+    view = current_app.view_functions.get(request.endpoint)
+
+    if (request.method not in ("GET", "HEAD") and session.get(CURR_USER_KEY)
+            and not getattr(view, "session_only", False)):
+        session[LAST_WRITE_KEY] = time.time()
+
+    return response
+
+
+def session_only(view):
+    """
+    The decorated view changes the session only, not the database: its
+    POSTs & PUTs don't send the user's next reads to the primary.
+    """
+
+    view.session_only = True
+    return view
+
+
+def replica_reads(view):
+    """
+    GET requests of the decorated view read from the replica, unless
+    the user wrote something in the last REPLICA_STICKY_SECONDS.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        last_write = session.get(LAST_WRITE_KEY, 0)
+        sticky = current_app.config["REPLICA_STICKY_SECONDS"]
+
+        if request.method in ("GET", "HEAD") and time.time() - last_write > sticky:
+            g.use_replica = True
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
 def do_login(user):
     """Log in user."""
 
@@ -123,23 +226,18 @@ def logged_in():
 
 
 def print_(date):
-    """Print todays date on terminal"""
-    
-    print("#"*30)
-    print(f"'/home' date => {date} - {type(date)}")
-    print("#"*30)
+    """Log the chosen date (DEBUG level)"""
+
+    logger.debug("'/home' date => %s - %s", date, type(date))
 
 
 def yaz(item):
-    """Print the item on terminal"""
-    
-    print("#"*30)
-    # print(f"'/home' TODAY => {date} - {type(date)}")
-    print(">"*5, "    ", item)
-    print("#"*30)
+    """Log the item (DEBUG level)"""
+
+    logger.debug(">>>>>     %s", item)
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
     Create new user and add to DB. Redirect to home page.
@@ -173,7 +271,7 @@ def signup():
         return render_template('signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -195,7 +293,7 @@ def login():
     return render_template('login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -205,43 +303,324 @@ def logout():
     return redirect("/login")
 
 
+##################################################################
+# SHARED BY THE PAGES & THE JSON API
+
+def day_logs(user_id, the_date):
+    """The user's food logs of the day (with their foods), in one query."""
+
+    return (FoodLog.query
+                   .options(db.joinedload(FoodLog.food))
+                   .filter(FoodLog.user_id == user_id,
+                           FoodLog.date == the_date)
+                   .order_by(FoodLog.id)
+                   .all())
+
+
+def day_totals(user, logs):
+    """Consumed calories of the day & what is left for the limit & need."""
+
+    calorie_sum = sum(round(log.calories) for log in logs)
+
+    return {
+        'calories': calorie_sum,
+        'calorie_need': user.calorie_need,
+        'calorie_limit': user.calorie_limit,
+        'left_for_limit': user.calorie_limit - calorie_sum,
+        'left_for_need': user.calorie_need - calorie_sum,
+    }
+
+
+def release_version(app):
+    """Hash of the templates & the asset manifest: pages look different after a deploy."""
+
+    digest = hashlib.sha256()
+    paths = [os.path.join(folder, name)
+             for folder, _, names in os.walk(os.path.join(app.root_path, app.template_folder))
+             for name in names]
+
+    for path in sorted(paths) + [assets.MANIFEST]:
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+
+def page_etag(*parts):
+    """
+    Strong ETag of a user page rendered from `parts`. The release & what
+    the left column shows (user, today, chosen date, cart) are always in it.
+    """
+
+    key = (current_app.config["RELEASE"], g.user.id, g.user.username, g.user.calorie_need, g.user.calorie_limit,
+           date.today(), session.get(DATE_KEY), len(session.get(CART_KEY, [])), parts)
+
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+
+
+def cached_page(etag, render):
+    """
+    304 Not Modified if the browser has the page of `etag`, else the page
+    render() returns. A page with flash messages waiting is never cached.
+    private: only the user's browser keeps it; no-cache: it asks every time.
+    """
+
+    if session.get('_flashes'):
+        response = make_response(render())
+    else:
+        # WEAK COMPARISON: A COMPRESSED PAGE'S ETAG IS WEAK (compression.py)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(render())
+        response.set_etag(etag)
+
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+def find_foods(term, page_num, mode, max_results=20):
+    """
+    Search results of a page as Fatsecret shapes them: ("api") from
+    Fatsecret, or when it fails from the local catalog ("local"), or
+    from the foods the user logged before ("mine").
+    Returns (food_list, last_page, mode actually used).
+    """
+
+    last_page = False
+
+    if mode == "api":
+        try:
+            food_list = get_fatsecret().foods_search(term,
+                                        page_number=page_num,
+                                        max_results=max_results)
+
+        except:
+            # API FAILED, FALL BACK TO OUR OWN FOOD LIST
+            mode = "local"
+
+    if mode == "mine":
+        food_list, last_page = UserFood.search(g.user.id, term,
+                                               page_number=page_num,
+                                               max_results=max_results)
+
+    elif mode == "local":
+        food_list, last_page = Food.search(term,
+                                           page_number=page_num,
+                                           max_results=max_results)
+
+    else:
+        try:
+            get_fatsecret().foods_search(term,
+                            page_number=page_num+1,
+                            max_results=max_results)
+
+        except:
+            last_page = True
+
+        # ONE RESULT COMES AS A DICT
+        food_list = as_list(food_list or [])
+
+    return food_list, last_page, mode
+
+
+def load_food(food_id):
+    """
+    The Fatsecret food_get result of a food, read through the local
+    catalog: Fatsecret is called only for new or stale foods. A fresh
+    food writes nothing.
+    """
+
+    food = Food.query.get(food_id)
+
+    if food is not None and food.food_serving and food.is_fresh(CATALOG_MAX_AGE):
+        return food.to_payload()
+
+    food_info = get_fatsecret().food_get(food_id)
+
+    if food is None:
+        # A NEW FOOD IS SAVED RIGHT AWAY (ONE INSERT EACH FOR THE FOOD & ITS SERVINGS)
+        Food.upsert(food_info)
+    else:
+        # THE WORKER COMPARES A STALE FOOD WITH FATSECRET'S & UPDATES WHAT CHANGED
+        Job.enqueue('ingest_food', {'food': food_info}, key=f"ingest_food:{food_id}")
+
+    db.session.commit()
+
+    return food_info
+
+
+def log_food(user_id, food_info, serving_id, amount, the_date):
+    """
+    Log `amount` of a serving of the food for the user & commit.
+    The food & its servings are saved in the same transaction (load_food
+    saved a new food already; a stale one may have new servings).
+    Raises LookupError if the food has no such serving.
+    """
+
+    serving = [s for s in as_list(food_info['servings']['serving'])
+               if s['serving_id'] == str(serving_id)]
+
+    if not serving:
+        raise LookupError(f"No serving #{serving_id} of food #{food_info['food_id']}")
+
+    Food.upsert(food_info)
+
+    foodlog = FoodLog.from_serving(
+        user_id=user_id,
+        food_id=int(food_info['food_id']),
+        serving=serving[0],
+        amount=amount,
+        the_date=the_date
+    )
+
+    db.session.add(foodlog)
+    db.session.commit()
+
+    return foodlog
+
+
 ##################################################################
 # ROUTES
 
-@app.route('/home')
+@bp.app_template_filter('add_days')
+def add_days(the_date, days):
+    """the_date | add_days(-7)"""
+
+    return the_date + timedelta(days=days)
+
+
+@bp.route('/home')
+@replica_reads
 def homepage():
     """We start here!"""
 
     if not logged_in():
         return redirect('/')
     
+    # FIND OUT THE DATE
+    # print_(THE_DATE)
+    return render_day(load_the_date())
+
+
+# PAGES LINK THE DAYS, WEEKS & MONTHS AROUND THEM, WHICH OVERFLOW NEAR
+# date.min & date.max, SO ONLY THESE DATES HAVE PAGES
+FIRST_PAGE_DATE = date(1, 2, 1)
+LAST_PAGE_DATE = date(9999, 10, 31)
+
+
+def page_date(text):
+    """The date (YYYY-MM-DD) of a page; 404 if it isn't one we can show."""
+
+    try:
+        the_date = date.fromisoformat(text)
+    except ValueError:
+        abort(404)
+
+    if not FIRST_PAGE_DATE <= the_date <= LAST_PAGE_DATE:
+        abort(404)
+
+    return the_date
+
+
+@bp.route('/day/<the_date>')
+@replica_reads
+def day_page(the_date):
+    """The list of a day, keyed by its date (YYYY-MM-DD) in the URL"""
+
+    if not logged_in():
+        return redirect('/')
+
+    THE_DATE = page_date(the_date)
+
+    # ADDING FOODS GOES TO THIS DAY
+    save_(THE_DATE)
+
+    return render_day(THE_DATE)
+
+
+def render_day(THE_DATE):
+    """The home page of a day; cached by the browser until a log of the day changes"""
+
     TODAY = date.today()
     # print_(TODAY)
 
-    # FIND OUT THE DATE
+    etag = page_etag('day', THE_DATE, DailyTotal.stamp(g.user.id, THE_DATE))
+
+    def render():
+        # USER'S FOODLOG FOR THE DAY (flud)
+        flud = day_logs(g.user.id, THE_DATE)
+
+        return render_template(
+            'home.html', 
+            user=g.user, 
+            today=TODAY, 
+            the_date=THE_DATE, 
+            foodlog=flud,
+            calorie_sum=day_totals(g.user, flud)['calories']
+        )
+
+    return cached_page(etag, render)
+
+
+# LONGEST RANGE OF THE WEEK VIEW
+MAX_RANGE_DAYS = 31
+
+
+@bp.route('/week')
+@bp.route('/week/<first>')
+@replica_reads
+def week_page(first=None):
+    """Logs & subtotals of ?days= (default 7) days from `first`
+    (default: the week ending on the chosen date), one query for all
+    """
+
+    if not logged_in():
+        return redirect('/')
+
+    TODAY = date.today()
     THE_DATE = load_the_date()
-    # print_(THE_DATE)
 
-    # USER'S FOODLOG FOR THE DAY (flud)
-    flud = FoodLog.query.filter(FoodLog.user_id == g.user.id,
-                                FoodLog.date == THE_DATE)
-    calorie_list = []
-    if flud.count() > 0:
-        for df in flud.all():
-            df.calories = round(df.calories)
-        calorie_list = [df.calories for df in flud.all()]
+    days = min(max(request.args.get('days', 7, type=int), 1), MAX_RANGE_DAYS)
 
-    return render_template(
-        'home.html', 
-        user=g.user, 
-        today=TODAY, 
-        the_date=THE_DATE, 
-        foodlog=flud.all(),
-        calorie_sum=sum(calorie_list)
-    )
+    FIRST = page_date(first) if first else THE_DATE - timedelta(days=days - 1)
 
+    LAST = FIRST + timedelta(days=days - 1)
 
-@app.route('/food/search', methods=["POST"])
+    etag = page_etag('week', FIRST, days, sorted(
+        (day, total.version, total.updated_at)
+        for day, total in DailyTotal.for_range(g.user.id, FIRST, LAST).items()))
+
+    def render():
+        # ALL THE DAYS, ALSO THE ONES WITHOUT LOGS
+        logs_by_day = {FIRST + timedelta(days=n): [] for n in range(days)}
+        for log in FoodLog.for_range(g.user.id, FIRST, LAST):
+            logs_by_day[log.date].append(log)
+
+        day_list = [(day, logs, day_totals(g.user, logs)) for day, logs in logs_by_day.items()]
+        total = sum(totals['calories'] for _, _, totals in day_list)
+
+        return render_template(
+            '/week.html',
+            user=g.user,
+            today=TODAY,
+            the_date=THE_DATE,
+            first=FIRST,
+            last=LAST,
+            days=days,
+            day_list=day_list,
+            total=total,
+            average=round(total / days),
+        )
+
+    return cached_page(etag, render)
+
+
+@bp.route('/food/search', methods=["POST"])
 def search_food():
 
     if not logged_in():
@@ -252,19 +631,33 @@ def search_food():
     THE_DATE = load_the_date()
 
     food = request.form["food"]
+    mode = request.form.get("mode", "api")
+
+    # LOCAL SEARCHES NEED NO API CHECK
+    if mode in ("local", "mine"):
+        return redirect(f"/food/search/{food}/{0}?mode={mode}")
+
+    # NOR DO SEARCHES WHOSE FIRST PAGE IS CACHED
+    if search_cache.get(search_key(food, 0, mode)) is not None:
+        return redirect(f"/food/search/{food}/{0}")
     
     try:
         # print("#"*30)
         # print(fs)
         # print(dir(fs))
         # print(dir(fs.foods_search))
-        food_list = fs.foods_search(food)
+        food_list = get_fatsecret().foods_search(food)
         # print("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
         # print(food_list)
         # print("%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%")
         return redirect(f"/food/search/{food}/{0}")
 
     except:
+        # API FAILED, TRY OUR OWN FOOD LIST
+        if Food.search(food, max_results=1)[0]:
+            flash("Showing results from our food list.", 'info')
+            return redirect(f"/food/search/{food}/{0}?mode=local")
+
         return render_template(
             '/errors/search.html', 
             user=g.user, 
@@ -274,9 +667,52 @@ def search_food():
         )
 
 
-@app.route('/food/search/<food>/<int:page_num>')
+def search_key(term, page_num, mode, page_size=SEARCH_PAGE_SIZE):
+    """Key of a search result page in search_cache; the term is normalized
+    ("  Green  APPLE" => "green apple")."""
+
+    return (mode, " ".join(term.lower().split()), page_num, page_size)
+
+
+def search_results(term, page_num, mode):
+    """
+    The rendered result list of a search page (foods/_results.html), the
+    same for every user, so Fatsecret & our food list pages are cached.
+    Returns (html, whether anything was found, mode actually used).
+    """
+
+    key = search_key(term, page_num, mode)
+
+    if mode != "mine":
+        cached = search_cache.get(key)
+        if cached is not None:
+            return cached
+
+    food_list, last_page, used_mode = find_foods(term, page_num, mode, SEARCH_PAGE_SIZE)
+
+    html = render_template(
+        '/foods/_results.html',
+        food_list=food_list,
+        search_term=key[1],
+        page_number=page_num,
+        page_size=SEARCH_PAGE_SIZE,
+        last_page=last_page,
+        mode=used_mode
+    )
+    results = (html, bool(food_list), used_mode)
+
+    # NOT THE USER'S OWN FOODS, NOR LOCAL RESULTS OF A FAILED API CALL
+    if used_mode == mode != "mine":
+        search_cache.set(key, results, len(html))
+
+    return results
+
+
+@bp.route('/food/search/<food>/<int:page_num>')
 def search_food_redirect(food, page_num):
     """ Make the Fatsecret API search and return the results
+    With ?mode=local (or when the API fails) search the local food catalog
+    With ?mode=mine search only the foods the user has logged before
     """
 
     if not logged_in():
@@ -286,8 +722,9 @@ def search_food_redirect(food, page_num):
     TODAY = date.today()
     THE_DATE = load_the_date()
 
-    max_results = 20
-    last_page = False
+    mode = request.args.get("mode", "api")
+    if mode not in ("api", "local", "mine"):
+        mode = "api"
 
     # SEARCH RESULTS FROM FATSECRET API
     # ---------------------------------
@@ -298,40 +735,28 @@ def search_food_redirect(food, page_num):
     #  'food_type': 'Brand',
     #  'food_url': 'https://www.fatsecret.com/calories-nutrition/great-value/orange-slices'},
     #  { ... }, ... ]
-    
-    food_list = fs.foods_search(food,
-                                page_number=page_num,
-                                max_results=max_results)
-
-    try:
-        fs.foods_search(food,
-                        page_number=page_num+1,
-                        max_results=max_results)
-
-    except:
-        last_page = True
+    results, found, mode = search_results(food, page_num, mode)
 
-    try:
-        # MANY RESULTS
-        food_list[0].get('food_id')
+    if not found and page_num == 0 and mode in ("local", "mine"):
+        return render_template(
+            '/errors/search.html', 
+            user=g.user, 
+            today=TODAY, 
+            the_date=THE_DATE, 
+            search_term=food
+        )
 
-    except:
-        # ONLY ONE RESULT
-        food_list=[food_list]
-    
     return render_template(
         '/foods/search.html', 
         user=g.user, 
         today=TODAY,
         the_date=THE_DATE,
-        food_list=food_list, 
-        search_term=food,
-        page_number=page_num,
-        last_page=last_page
+        results=results,
+        search_term=food
     )
 
 
-@app.route('/food/add/<int:food_id>', methods=["GET", "POST"])
+@bp.route('/food/add/<int:food_id>', methods=["GET", "POST"])
 def add_food(food_id):
     """takes the chosen food and calculates its values
     """
@@ -355,90 +780,28 @@ def add_food(food_id):
         food_id = int(food_id)
 
         foodinfo = session[FOOD_KEY] 
-        serv = foodinfo['servings']['serving']
-
-        # DATABASE REGISTERING OF FOOD & ITS INFO
-        try:
-            Food.query.filter_by(id=food_id).one()
-            # yaz("THE FOOD IS PRESENT IN DB !!")
-        except:
-            # yaz("THE FOOD NEEDS TO BE SAVED IN DB !!")
-            brand = foodinfo.get('brand_name') or "Generic"
-
-            food = Food(
-                id=food_id,
-                name=foodinfo['food_name'],
-                brand=brand,
-                food_url=foodinfo['food_url']
-            )
-
-            db.session.add(food)
-            db.session.commit()
+        serv = as_list(foodinfo['servings']['serving'])
 
-            # SEND FOOD INFO TO LOCAL DATABASE
-            try:
-                # ONE SERVING
-                serv.get('fat')
-                food_info = FoodServing(food_id=food_id, **serv)
-                db.session.add(food_info)
+        logger.debug("Logging food #%s serving #%s of %s", food_id, serving_id, serv)
 
-            except:
-                # LIST SERVING
-                for s in serv:
-                    food_info = FoodServing(food_id=food_id, **s)
-                    db.session.add(food_info)
-
-            db.session.commit()
-
-        # SEND FOOD-LOG TO DATABASE
+        # FOOD, ITS SERVINGS & THE FOOD-LOG GO TO DATABASE IN ONE TRANSACTION
         try:
-            serving_info = FoodServing.query.filter_by(serving_id=serving_id).one()
+            log_food(g.user.id, foodinfo, serving_id, amount, THE_DATE)
 
-        except:       
+        except LookupError:
             return render_template(
                         '/errors/database.html', 
                         user=g.user, 
                         today=TODAY,
                         the_date=THE_DATE, 
                     )
-        
-        print("food_id")
-        print(food_id)
-        print("serving_id")
-        print(serving_id)
-        print("serv")
-        print(serv)
-
-        # make serv a list if it is only one item
-        try:
-            serv[0]
-        except:
-            serv = [serv]
-
-        number_of_units = [float(s['number_of_units']) for s in serv if s['serving_id'] == str(serving_id)][0]
-
-        calories = serving_info.calories * amount / number_of_units
-        
-        foodlog = FoodLog(
-            user_id=g.user.id,
-            food_id=food_id,
-            serving_id=serving_info.serving_id,
-            serving_description=serving_info.serving_description,
-            unit_calories=serving_info.calories,
-            amount=amount, 
-            number_of_units=number_of_units,
-            calories=calories,
-            date=THE_DATE,
-        )
-
-        db.session.add(foodlog)
-        db.session.commit()
 
         return redirect('/home')
     
     # GET REQUEST PART ###
     # --------------------
-    food_info = fs.food_get(food_id)
+    # READ THROUGH THE LOCAL CATALOG, FATSECRET ONLY FOR NEW OR STALE FOODS
+    food_info = load_food(food_id)
 
     # save food_info in session for global access
     session[FOOD_KEY] = food_info
@@ -456,7 +819,8 @@ def add_food(food_id):
     for val in serving_values:
         if val['serving_description'] == '100 g':
             cals = val['calories']
-        val['metric_serving_amount'] = str(int(round(float(val['metric_serving_amount']))))
+        if val.get('metric_serving_amount'):
+            val['metric_serving_amount'] = str(int(round(float(val['metric_serving_amount']))))
 
     return render_template(
         '/foods/add.html', 
@@ -469,7 +833,8 @@ def add_food(food_id):
     )
 
 
-@app.route('/food/edit/<int:log_id>', methods=["GET", "POST"])
+@bp.route('/food/edit/<int:log_id>', methods=["GET", "POST"])
+@replica_reads
 def edit_food(log_id):
     """
     """
@@ -486,7 +851,7 @@ def edit_food(log_id):
     if request.form:
         amount = float(request.form["amount"])
 
-        log = FoodLog.query.get_or_404(log_id)
+        log = FoodLog.query.filter_by(id=log_id, user_id=g.user.id).first_or_404()
         log.amount = amount
         log.calories = log.amount * log.unit_calories / log.number_of_units
 
@@ -499,7 +864,7 @@ def edit_food(log_id):
 
     # GET REQUEST PART ###
     # --------------------
-    log = FoodLog.query.get_or_404(log_id)
+    log = FoodLog.query.filter_by(id=log_id, user_id=g.user.id).first_or_404()
 
     return render_template(
                 '/foods/edit.html',
@@ -510,18 +875,18 @@ def edit_food(log_id):
             )
 
 
-@app.route('/food/delete/<int:log_id>', methods=["POST"])
+@bp.route('/food/delete/<int:log_id>', methods=["POST"])
 def delete_food(log_id):
     """
     """
 
     # CHECK IF THE USER LOGGED IN
-    if not session.get(CURR_USER_KEY):
+    if not logged_in():
         return redirect('/')
 
     # NO NEED TO FIND OUT THE DATE
 
-    log = FoodLog.query.get_or_404(log_id)
+    log = FoodLog.query.filter_by(id=log_id, user_id=g.user.id).first_or_404()
     
     db.session.delete(log)
     db.session.commit()
@@ -529,47 +894,340 @@ def delete_food(log_id):
     return redirect('/home')
 
 
-@app.route('/food/frequent')
-def frequent_foods():
-    """It lists user's most frequent eaten 20 foods by frequency
+def form_log_ids():
+    """Checked log ids of the posted form"""
+
+    try:
+        return {int(log_id) for log_id in request.form.getlist('log_ids')}
+    except ValueError:
+        abort(400)
+
+
+@bp.route('/food/batch-edit', methods=["POST"])
+def batch_edit_food():
+    """Changes the amounts (amount-<log id> fields) of many logs at once
     """
 
-    # CHECK IF THE USER LOGGED IN
     if not logged_in():
         return redirect('/')
 
-    # FIND OUT THE DATE
-    TODAY = date.today()
-    THE_DATE = load_the_date()
+    try:
+        amounts = {int(key[len('amount-'):]): float(value)
+                   for key, value in request.form.items()
+                   if key.startswith('amount-') and value}
+    except ValueError:
+        abort(400)
 
-    freq_20_foods = (
-        db.session.query(
-            Food, db.func.count(FoodLog.food_id))
-                         .join(FoodLog)
-                         .filter_by(user_id=g.user.id)
-                         .group_by(Food.id)
-                         .order_by(db.func.count(FoodLog.food_id)
-                                          .desc())
-                         .limit(20)
-                         .all()
-    )
+    # AMOUNTS MUST BE POSITIVE, AS IN THE JSON API
+    if not all(amount > 0 for amount in amounts.values()):
+        abort(400)
 
-    return render_template(
-        '/foods/frequent.html',
-        user=g.user, 
+    # ALL THE LOGS MUST BE THE USER'S, OR NONE IS CHANGED
+    if FoodLog.update_amounts(g.user.id, amounts) != len(amounts):
+        db.session.rollback()
+        abort(404)
+
+    db.session.commit()
+    flash(f"{len(amounts)} food logs updated.", 'success')
+
+    return redirect('/home')
+
+
+@bp.route('/food/batch-delete', methods=["POST"])
+def batch_delete_food():
+    """Deletes the checked logs at once
+    """
+
+    if not logged_in():
+        return redirect('/')
+
+    log_ids = form_log_ids()
+
+    # ALL THE LOGS MUST BE THE USER'S, OR NONE IS DELETED
+    if FoodLog.delete_many(g.user.id, log_ids) != len(log_ids):
+        db.session.rollback()
+        abort(404)
+
+    db.session.commit()
+    flash(f"{len(log_ids)} food logs deleted.", 'success')
+
+    return redirect('/home')
+
+
+##################################################################
+# CART: STAGE SEVERAL FOODS, LOG THEM TOGETHER
+
+def fetch_food(food_id):
+    """Fatsecret food_get on its own client (one per thread)."""
+
+    return new_fatsecret().food_get(food_id)
+
+
+@bp.route('/cart/add/<int:food_id>', methods=["POST"])
+def add_to_cart(food_id):
+    """Puts the chosen food, serving & amount in the cart (session)
+    """
+
+    if not logged_in():
+        return redirect('/')
+
+    amount = api_amount(request.form)
+    if amount is None:
+        abort(400)
+
+    food_id, serving_id = ast.literal_eval(request.form["servings"].strip())
+
+    # NAMES FOR THE CART PAGE FROM THE FOOD SHOWN ON THE ADD PAGE
+    foodinfo = session.get(FOOD_KEY) or {}
+    serving = [s for s in as_list(foodinfo.get('servings', {}).get('serving', []))
+               if s['serving_id'] == str(serving_id)]
+
+    cart = session.get(CART_KEY, [])
+    cart.append({
+        "food_id": int(food_id),
+        "serving_id": int(serving_id),
+        "amount": amount,
+        "food_name": foodinfo.get('food_name', f"Food #{food_id}"),
+        "serving_description": serving[0]['serving_description'] if serving else "",
+    })
+    session[CART_KEY] = cart
+
+    return redirect('/cart')
+
+
+@bp.route('/cart')
+def show_cart():
+    """Lists the foods in the cart
+    """
+
+    if not logged_in():
+        return redirect('/')
+
+    # FIND OUT THE DATE
+    TODAY = date.today()
+    THE_DATE = load_the_date()
+
+    return render_template(
+        '/foods/cart.html',
+        user=g.user,
         today=TODAY,
         the_date=THE_DATE,
-        freq_20_foods=freq_20_foods,
+        cart=session.get(CART_KEY, []),
     )
 
 
-@app.route('/calendar', methods=["GET", "POST"])
-def change_date():
+@bp.route('/cart/remove/<int:index>', methods=["POST"])
+def remove_from_cart(index):
+    """Takes a food out of the cart
     """
+
+    if not logged_in():
+        return redirect('/')
+
+    cart = session.get(CART_KEY, [])
+    if 0 <= index < len(cart):
+        del cart[index]
+        session[CART_KEY] = cart
+
+    return redirect('/cart')
+
+
+@bp.route('/cart/commit', methods=["POST"])
+def commit_cart():
+    """Logs every food in the cart in one transaction
+    Foods missing from the local catalog are fetched from the API in parallel
+    """
+
+    if not logged_in():
+        return redirect('/')
+
+    # FIND OUT THE DATE
+    THE_DATE = load_the_date()
+
+    cart = session.get(CART_KEY, [])
+
+    # AMOUNTS MAY BE CHANGED ON THE CART PAGE; ONE BAD AMOUNT LOGS NOTHING
+    amounts = {index: api_amount({"amount": request.form[f"amount-{index}"]})
+               for index in range(len(cart)) if request.form.get(f"amount-{index}")}
+
+    if None in amounts.values():
+        abort(400)
+
+    for index, amount in amounts.items():
+        cart[index]["amount"] = amount
+
+    known = {s.serving_id: s for s in FoodServing.query.filter(
+        FoodServing.serving_id.in_([item["serving_id"] for item in cart]))}
+    missing = {item["food_id"] for item in cart if item["serving_id"] not in known}
+
+    try:
+        with ThreadPoolExecutor(max_workers=API_WORKERS) as pool:
+            payloads = list(pool.map(fetch_food, missing))
+
+    except Exception:
+        flash("Food details could not be loaded, please try again.", 'danger')
+        return redirect('/cart')
+
+    # FOODS, SERVINGS & ALL FOOD-LOGS GO TO DATABASE IN ONE TRANSACTION
+    fetched = {}
+    for payload in payloads:
+        Food.upsert(payload)
+        for serving in as_list(payload['servings']['serving']):
+            fetched[int(serving['serving_id'])] = serving
+
+    logs = []
+    left_out = []
+    for item in cart:
+        serving = known.get(item["serving_id"]) or fetched.get(item["serving_id"])
+        if serving is None:
+            # THE FOOD HAS NO SUCH SERVING (ANY MORE)
+            left_out.append(item)
+            continue
+
+        logs.append(FoodLog.from_serving(
+            user_id=g.user.id,
+            food_id=item["food_id"],
+            serving=serving,
+            amount=item["amount"],
+            the_date=THE_DATE
+        ))
+
+    FoodLog.insert_many(logs)
+    db.session.commit()
+
+    session[CART_KEY] = left_out
+
+    if logs:
+        flash(f"{len(logs)} foods logged.", 'success')
+
+    if left_out:
+        flash(f"{len(left_out)} foods could not be logged, their servings were not found. "
+              f"They are still in the cart.", 'warning')
+        return redirect('/cart')
+
+    return redirect('/home')
+
+
+@bp.route('/food/copy', methods=["POST"])
+def copy_food():
+    """Copies the day's (or `days` days') food logs, or only the checked
+    ones, to another date in one statement
     """
 
     # CHECK IF THE USER LOGGED IN
-    if not session.get(CURR_USER_KEY):
+    if not logged_in():
+        return redirect('/')
+
+    # FIND OUT THE DATE
+    THE_DATE = load_the_date()
+
+    try:
+        to_date = date.fromisoformat(request.form["to_date"])
+        from_date = date.fromisoformat(request.form.get("from_date") or THE_DATE.isoformat())
+        days = min(max(int(request.form.get("days", 1)), 1), 31)
+    except (KeyError, ValueError):
+        flash("Please choose a date to copy to.", 'danger')
+        return redirect('/home')
+
+    log_ids = form_log_ids()
+
+    copied = FoodLog.copy_entries(g.user.id, from_date, to_date,
+                                  days=days, log_ids=log_ids)
+    db.session.commit()
+
+    flash(f"{copied} food logs copied to {to_date.strftime('%B %d, %Y')}.", 'success')
+
+    return redirect('/home')
+
+
+@bp.route('/food/frequent')
+@replica_reads
+def frequent_foods():
+    """It lists user's most frequent eaten 20 foods by frequency
+    """
+
+    # CHECK IF THE USER LOGGED IN
+    if not logged_in():
+        return redirect('/')
+
+    # FIND OUT THE DATE
+    TODAY = date.today()
+    THE_DATE = load_the_date()
+
+    etag = page_etag('frequent', UserFood.stamp(g.user.id))
+
+    def render():
+        # user_foods KEEPS THE COUNTS, NO NEED TO GROUP THE FOOD LOGS
+        freq_20_foods = (
+            db.session.query(Food, UserFood.log_count, UserFood)
+                      .join(UserFood, UserFood.food_id == Food.id)
+                      .filter(UserFood.user_id == g.user.id,
+                              UserFood.log_count > 0)
+                      .order_by(UserFood.log_count.desc(),
+                                UserFood.last_logged.desc())
+                      .limit(20)
+                      .all()
+        )
+
+        # SERVINGS OF ALL 20 FOODS FOR QUICK ADD, IN ONE QUERY
+        servings = {}
+        for serving in (FoodServing.query
+                            .filter(FoodServing.food_id.in_([f[0].id for f in freq_20_foods]))
+                            .order_by(FoodServing.serving_id)):
+            servings.setdefault(serving.food_id, []).append(serving)
+
+        return render_template(
+            '/foods/frequent.html',
+            user=g.user, 
+            today=TODAY,
+            the_date=THE_DATE,
+            freq_20_foods=freq_20_foods,
+            servings=servings,
+        )
+
+    return cached_page(etag, render)
+
+
+@bp.route('/food/quick-add/<int:food_id>', methods=["POST"])
+def quick_add_food(food_id):
+    """Logs a food of the local catalog with the chosen serving & amount
+    (no API call)
+    """
+
+    # CHECK IF THE USER LOGGED IN
+    if not logged_in():
+        return redirect('/')
+
+    # FIND OUT THE DATE
+    THE_DATE = load_the_date()
+
+    serving = FoodServing.query.filter_by(
+        food_id=food_id,
+        serving_id=int(request.form["serving_id"])
+    ).first_or_404()
+
+    foodlog = FoodLog.from_serving(
+        user_id=g.user.id,
+        food_id=food_id,
+        serving=serving,
+        amount=float(request.form["amount"]),
+        the_date=THE_DATE
+    )
+
+    db.session.add(foodlog)
+    db.session.commit()
+
+    return redirect('/home')
+
+
+@bp.route('/calendar', methods=["GET", "POST"])
+@replica_reads
+@session_only
+def change_date():
+    """The date picker & the calendar of the chosen date's month"""
+
+    # CHECK IF THE USER LOGGED IN (AND STILL EXISTS, THE CALENDAR READS g.user)
+    if not logged_in():
         return redirect('/')
 
     # FIND OUT THE DATE
@@ -580,20 +1238,74 @@ def change_date():
 
         the_date = request.form["chosen_date"]   # STRING
         print_(the_date)
-        THE_DATE = date.fromisoformat(the_date)  # OBJECT
+        THE_DATE = page_date(the_date)  # OBJECT
         save_(THE_DATE)
 
         return redirect('/home')
 
-    return render_template(
-        'calendar.html', 
-        user=g.user, 
-        today=TODAY,
-        the_date=THE_DATE,
-    )
+    return render_month(THE_DATE.replace(day=1))
+
+
+@bp.route('/calendar/<month>')
+@replica_reads
+def month_page(month):
+    """The calendar of a month (YYYY-MM) in the URL"""
+
+    if not logged_in():
+        return redirect('/')
+
+    FIRST = page_date(f"{month}-01")
+
+    return render_month(FIRST)
+
+
+def calorie_level(calories, user):
+    """Heat of a day's calories: 'low' up to the lower of the user's
+    calorie need & limit, 'high' above the higher one, else 'mid'."""
 
+    low, high = sorted((user.calorie_need, user.calorie_limit))
 
-@app.route('/day-change/<direction>/<int:days>')
+    if calories <= low:
+        return 'low'
+    if calories <= high:
+        return 'mid'
+    return 'high'
+
+
+def render_month(FIRST):
+    """The calendar of the month starting on FIRST, each day colored by its
+    calories. Read from daily_totals in one query; the page is cached by the
+    browser until a log of the month (or the user's limits) changes."""
+
+    TODAY = date.today()
+    THE_DATE = load_the_date()
+
+    weeks = Calendar().monthdatescalendar(FIRST.year, FIRST.month)
+    totals = DailyTotal.for_range(g.user.id, weeks[0][0], weeks[-1][-1])
+
+    etag = page_etag('month', FIRST, sorted(
+        (day, total.version, total.updated_at) for day, total in totals.items()))
+
+    def render():
+        days = {day: (round(total.calories), calorie_level(total.calories, g.user))
+                for day, total in totals.items() if total.entries}
+
+        return render_template(
+            'calendar.html',
+            user=g.user,
+            today=TODAY,
+            the_date=THE_DATE,
+            first=FIRST,
+            previous=add_months(FIRST, -1),
+            next=add_months(FIRST, 1),
+            weeks=weeks,
+            days=days,
+        )
+
+    return cached_page(etag, render)
+
+
+@bp.route('/day-change/<direction>/<int:days>')
 def change_day(direction, days):
     """Change the date."""
 
@@ -625,16 +1337,405 @@ def change_day(direction, days):
 
     save_(THE_DATE)
     
-    print_(THE_DATE)   # prints to terminal
+    print_(THE_DATE)   # logs at DEBUG level
 
     return redirect('/home')
 
 
+@bp.route('/food/import', methods=["GET", "POST"])
+def import_food_logs():
+    """Bulk import of food logs from a CSV or JSON lines file
+    """
+
+    # CHECK IF THE USER LOGGED IN
+    if not logged_in():
+        return redirect('/')
+
+    # FIND OUT THE DATE
+    TODAY = date.today()
+    THE_DATE = load_the_date()
+
+    upload = request.files.get("file")
+
+    # LARGER UPLOADS ARE REFUSED WITH 413 (too_large_upload)
+    if upload and upload.filename:
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8")
+        result = import_logs(g.user.id, stream, fmt=file_format(upload.filename))
+
+        flash(f"{result['imported']} food logs imported, "
+              f"{result['skipped']} rows skipped.", 'success')
+
+        return redirect('/home')
+
+    return render_template(
+        '/foods/import.html',
+        user=g.user,
+        today=TODAY,
+        the_date=THE_DATE,
+        max_mb=current_app.config["MAX_CONTENT_LENGTH"] // (1024 * 1024),
+    )
+
+
+@bp.app_errorhandler(413)
+def too_large_upload(e):
+    """A request body over MAX_CONTENT_LENGTH (e.g. a big import file)."""
+
+    if request.path.startswith(API_PREFIX):
+        return api_error(413, "Request body too large")
+
+    flash(f"The file is too large, the limit is "
+          f"{current_app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB.", 'danger')
+
+    return redirect('/food/import')
+
+
+@bp.route('/food/export/<fmt>')
+@replica_reads
+def export_food_logs(fmt):
+    """Streams all food logs of the user as CSV or JSON lines
+    """
+
+    # CHECK IF THE USER LOGGED IN
+    if not logged_in():
+        return redirect('/')
+
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    export, mimetype = EXPORT_FORMATS[fmt]
+    rows = export_rows(g.user.id)
+
+    # NO CONTENT-LENGTH: THE SERVER SENDS IT IN CHUNKS AS IT IS GENERATED
+    return Response(
+        stream_with_context(export(rows)),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition":
+                f"attachment; filename=food-logs-{g.user.username}.{fmt}"
+        }
+    )
+
+
+##################################################################
+# JSON API (v1): THE SESSION COOKIE OF THE LOGIN AUTHENTICATES
+
+API_PREFIX = '/api/v1'
+
+
+def api_error(status, message):
+    """JSON error response"""
+
+    return jsonify(error=message), status
+
+
+def api_login_required(view):
+    """JSON 401 instead of the login redirect"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not logged_in():
+            return api_error(401, "Login required")
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def api_day(user, the_date):
+    """A day's food logs & totals"""
+
+    logs = day_logs(user.id, the_date)
+
+    return {
+        'date': the_date.isoformat(),
+        'logs': [log.to_dict() for log in logs],
+        'totals': day_totals(user, logs),
+    }
+
+
+def api_amount(data):
+    """The positive `amount` of a JSON body, or None"""
+
+    try:
+        amount = float(data['amount'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    return amount if amount > 0 else None
+
+
+@bp.route(f'{API_PREFIX}/days/<the_date>')
+@api_login_required
+@replica_reads
+def api_get_day(the_date):
+    """The user's food logs & calorie totals of a day (YYYY-MM-DD)"""
+
+    try:
+        the_date = date.fromisoformat(the_date)
+    except ValueError:
+        return api_error(400, "Dates are YYYY-MM-DD")
+
+    return jsonify(api_day(g.user, the_date))
+
+
+@bp.route(f'{API_PREFIX}/date', methods=["PUT"])
+@api_login_required
+@session_only
+def api_set_date():
+    """Choose the date foods are added to: {date}"""
+
+    try:
+        the_date = date.fromisoformat((request.get_json(silent=True) or {})['date'])
+    except (KeyError, TypeError, ValueError):
+        return api_error(400, "Dates are YYYY-MM-DD")
+
+    # THE DAY PAGE OF THE CHOSEN DATE MUST BE ONE WE CAN SHOW
+    if not FIRST_PAGE_DATE <= the_date <= LAST_PAGE_DATE:
+        return api_error(400, "That date is out of range")
+
+    save_(the_date)
+
+    return '', 204
+
+
+@bp.route(f'{API_PREFIX}/foods/search')
+@api_login_required
+def api_search_foods():
+    """Search results: ?q=<term>&page=<number>&mode=api|local|mine"""
+
+    term = request.args.get('q', '').strip()
+    page = request.args.get('page', 0, type=int)
+    mode = request.args.get('mode', 'api')
+
+    if not term:
+        return api_error(400, "The q parameter is required")
+    if mode not in ("api", "local", "mine"):
+        return api_error(400, "mode is api, local or mine")
+
+    food_list, last_page, mode = find_foods(term, page, mode)
+
+    return jsonify(results=food_list, page=page, last_page=last_page, mode=mode)
+
+
+@bp.route(f'{API_PREFIX}/foods/<int:food_id>')
+@api_login_required
+def api_get_food(food_id):
+    """The food & its servings, shaped like Fatsecret's food_get"""
+
+    try:
+        return jsonify(load_food(food_id))
+    except Exception:
+        return api_error(502, "Food details could not be loaded")
+
+
+@bp.route(f'{API_PREFIX}/logs', methods=["POST"])
+@api_login_required
+def api_create_log():
+    """Log a food: {food_id, serving_id, amount, date (default: the chosen date)}"""
+
+    data = request.get_json(silent=True) or {}
+    amount = api_amount(data)
+
+    try:
+        food_id = int(data['food_id'])
+        serving_id = int(data['serving_id'])
+        the_date = date.fromisoformat(data.get('date') or session.get(DATE_KEY)
+                                      or date.today().isoformat())
+    except (KeyError, TypeError, ValueError):
+        return api_error(400, "food_id, serving_id & a positive amount are required")
+
+    if amount is None:
+        return api_error(400, "food_id, serving_id & a positive amount are required")
+
+    # THE FOOD OF THE ADD PAGE IS IN THE SESSION ALREADY
+    food_info = session.get(FOOD_KEY)
+
+    if not food_info or str(food_info.get('food_id')) != str(food_id):
+        try:
+            food_info = load_food(food_id)
+        except Exception:
+            return api_error(502, "Food details could not be loaded")
+
+    try:
+        foodlog = log_food(g.user.id, food_info, serving_id, amount, the_date)
+    except LookupError as e:
+        return api_error(404, str(e))
+
+    return jsonify(log=foodlog.to_dict(), day=api_day(g.user, the_date)), 201
+
+
+@bp.route(f'{API_PREFIX}/logs/<int:log_id>', methods=["PATCH"])
+@api_login_required
+def api_update_log(log_id):
+    """Change the amount of a log: {amount}"""
+
+    amount = api_amount(request.get_json(silent=True) or {})
+    if amount is None:
+        return api_error(400, "A positive amount is required")
+
+    if FoodLog.update_amounts(g.user.id, {log_id: amount}) != 1:
+        db.session.rollback()
+        return api_error(404, "No such food log")
+
+    db.session.commit()
+
+    foodlog = FoodLog.query.filter_by(id=log_id).one()
+
+    return jsonify(log=foodlog.to_dict(), day=api_day(g.user, foodlog.date))
+
+
+@bp.route(f'{API_PREFIX}/logs/<int:log_id>', methods=["DELETE"])
+@api_login_required
+def api_delete_log(log_id):
+    """Delete a log"""
+
+    foodlog = FoodLog.query.filter_by(id=log_id, user_id=g.user.id).first()
+    if foodlog is None:
+        return api_error(404, "No such food log")
+
+    the_date = foodlog.date
+    FoodLog.delete_many(g.user.id, [log_id])
+    db.session.commit()
+
+    return jsonify(deleted=log_id, day=api_day(g.user, the_date))
+
+
+@bp.cli.command('import-logs')
+@click.argument('username')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json']),
+              help='File format (default: by the file extension).')
+def import_logs_command(username, file, fmt):
+    """Bulk import of a user's food logs from a CSV or JSON lines FILE."""
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.BadParameter(f"No user named {username}", param_hint='USERNAME')
+
+    def progress(imported, skipped):
+        click.echo(f"  {imported} imported, {skipped} skipped")
+
+    result = import_logs(user.id, file, fmt=fmt or file_format(file.name),
+                         progress=progress)
+
+    click.echo(f"Done: {result['imported']} imported, {result['skipped']} skipped")
+
+
+@bp.cli.command('refresh-popularity')
+def refresh_popularity_command():
+    """Recount how many times each food is logged (local search ranking)."""
+
+    changed = Food.refresh_popularity()
+    db.session.commit()
+
+    click.echo(f"Popularity of {changed} food(s) changed")
+
+
+@bp.cli.command('rebuild-user-foods')
+def rebuild_user_foods_command():
+    """Update the user_foods triggers & recount every user's logged foods
+    (the "my foods" search index)."""
+
+    db.session.execute(db.text(USER_FOODS_TRIGGERS))
+    UserFood.rebuild()
+    db.session.commit()
+
+    click.echo(f"{UserFood.query.count()} user foods rebuilt")
+
+
+@bp.cli.command('rebuild-daily-totals')
+def rebuild_daily_totals_command():
+    """Create the daily_totals table & triggers if missing & recount it."""
+
+    DailyTotal.__table__.create(db.engine, checkfirst=True)
+    db.session.execute(db.text(DAILY_TOTALS_TRIGGERS))
+    DailyTotal.rebuild()
+    db.session.commit()
+
+    click.echo(f"{DailyTotal.query.count()} daily totals rebuilt")
+
+
+@bp.cli.command('export-columnar')
+@click.argument('out_dir', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['parquet', 'arrow']),
+              default='parquet', help='Columnar file format.')
+@click.option('--username', help='Export only the logs of this user.')
+def export_columnar_command(out_dir, fmt, username):
+    """Export the food logs with nutrients into monthly columnar files."""
+
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            raise click.BadParameter(f"No user named {username}", param_hint='--username')
+        user_id = user.id
+
+    try:
+        written = columnar_export(out_dir, fmt=fmt, user_id=user_id,
+                                  progress=lambda n: click.echo(f"  {n} rows written"))
+    except ImportError:
+        raise click.ClickException("The columnar export needs pyarrow: pip install pyarrow")
+
+    click.echo(f"Done: {written} rows in {out_dir}")
+
+
+@bp.cli.command('assets-vendor')
+def assets_vendor_command():
+    """Download the third-party CSS, JS & fonts into static/vendor/ (to commit)."""
+
+    written = assets.vendor(progress=lambda path: click.echo(f"  {path}"))
+
+    click.echo(f"{len(written)} file(s) vendored")
+
+
+@bp.cli.command('assets-build')
+def assets_build_command():
+    """Bundle, fingerprint & compress the static assets into static/dist/."""
+
+    try:
+        manifest = assets.build(progress=lambda name, size: click.echo(f"  {name} ({size} bytes)"))
+    except FileNotFoundError as e:
+        raise click.ClickException(str(e))
+
+    for name, missing in manifest['skipped'].items():
+        click.echo(f"{name} was not built, its pages use the CDNs (run `flask assets-vendor` "
+                   f"& commit static/vendor/): missing {', '.join(missing)}")
+
+    if not manifest['srcsets']:
+        click.echo("Pillow is not installed: no resized images were built")
+
+    click.echo("Assets built, restart the app to serve them")
+
+
+@bp.cli.command('worker')
+@click.option('--once', is_flag=True, help='Stop when the queue is empty.')
+@click.option('--scheduler', is_flag=True, help='Also queue the periodic jobs (run one such worker).')
+@click.option('--poll', default=POLL_INTERVAL, help='Seconds to wait when the queue is empty.')
+def worker_command(once, scheduler, poll):
+    """Run background jobs from the jobs queue."""
+
+    count = run_worker(once=once, scheduler=scheduler, poll_interval=poll)
+
+    click.echo(f"{count} job(s) run")
+
+
+@bp.cli.command('enqueue')
+@click.argument('kind', type=click.Choice(sorted(HANDLERS)))
+@click.option('--payload', default='{}', help='Job payload as JSON.')
+def enqueue_command(kind, payload):
+    """Queue a background job of KIND."""
+
+    Job.enqueue(kind, json.loads(payload))
+    db.session.commit()
+
+    click.echo(f"{kind} job queued")
+
+
 ##################################################################
 # Homepage and error pages
 
 
-@app.route('/', methods=["GET", "POST"])
+@bp.route('/', methods=["GET", "POST"])
 def route():
     """Show welcome page"""
 
@@ -646,27 +1747,75 @@ def route():
         return redirect('/login')
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
     """404 NOT FOUND page."""
 
     # CHECK IF THE USER LOGGED IN
-    if not session.get(CURR_USER_KEY):
+    if not logged_in():
         return redirect('/')
 
-    return render_template('/errors/404.html'), 404
+    TODAY = date.today()
+    THE_DATE = load_the_date() if DATE_KEY in session else TODAY
+
+    return render_template(
+        '/errors/404.html',
+        user=g.user,
+        today=TODAY,
+        the_date=THE_DATE,
+    ), 404
 
 
-@app.route('/test')
+@bp.route('/test')
 def show_test():
-    """ A test route to print all os.environ data on the terminal
+    """ A test route to log all os.environ data (debug mode only)
     """
 
-    print("#"*30)
-    # print(os.environ)
-    print(type(os.environ))
-    print("#"*30)
-    [print(f"{k}  ==>>  {v}") for k,v in os.environ.items()]
-    print("#"*30)
+    if not current_app.debug:
+        abort(404)
+
+    for k, v in os.environ.items():
+        logger.debug("%s  ==>>  %s", k, v)
+
+    return "X"
+
+##################################################################
+# App factory
+
+def create_app(config=None):
+    """
+    The Calorie Counter app with `config`: a class of config.py, its name
+    ('development', 'production', 'testing'), or by default the one the
+    APP_CONFIG / FLASK_ENV env vars name.
+    """
+
+    if config is None:
+        config = config_from_env()
+    elif isinstance(config, str):
+        config = CONFIGS[config]
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    logging.basicConfig(level=app.config["LOG_LEVEL"],
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # FIRST: THE TOOLBAR MUST ADD ITSELF TO THE HTML BEFORE IT IS COMPRESSED
+    compression.init_app(app)
+
+    if app.config["DEBUG_TOOLBAR"]:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    metrics.init_app(app)
+    assets.init_app(app)
+
+    app.register_blueprint(bp)
+    app.config["RELEASE"] = release_version(app)
+
+    return app
+
 
-    return "X"
\ No newline at end of file
+# THE APP OF `gunicorn app:app`, `flask` & THE TESTS
+app = create_app()
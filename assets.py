@@ -0,0 +1,417 @@
+"""Static asset pipeline of Calorie Counter
+
+`flask assets-vendor` downloads the third-party CSS, JS & fonts (pinned
+versions) into static/vendor/; deploys build from what is committed,
+never from CDNs. `flask assets-build` then writes static/dist/:
+
+- vendor.<hash>.css: Bootstrap, Font Awesome & Roboto in one file, with
+  the fonts & images it refers to fingerprinted next to it
+- app.<hash>.css: our stylesheet
+- vendor.<hash>.js: jQuery; app.<hash>.js: our scripts in one file
+- .gz & .br (with the brotli package) variants of the text files
+- the background resized to RESPONSIVE_WIDTHS as JPEG, WebP & AVIF (with
+  the Pillow package)
+- manifest.json, mapping the source names to the built files
+
+Built files are served from /assets/ with a far-future Cache-Control;
+their names change whenever their content does. The vendor bundles are
+skipped while static/vendor/ is missing, the rest is always built; what
+isn't built, the templates take from the source files & CDNs.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+import urllib.parse
+import urllib.request
+
+from flask import request, send_from_directory, url_for, abort
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+
+# SOURCE URLS OF THE VENDORED FILES (PATHS UNDER static/)
+VENDOR = {
+    'vendor/bootstrap/bootstrap.min.css':
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/css/bootstrap.min.css',
+    'vendor/fontawesome/css/all.css':
+        'https://use.fontawesome.com/releases/v5.3.1/css/all.css',
+    'vendor/roboto/roboto.css':
+        'https://fonts.googleapis.com/css2?family=Roboto:ital,wght@0,400;0,700;1,400;1,700&display=swap',
+    'vendor/jquery/jquery.min.js':
+        'https://code.jquery.com/jquery-3.7.1.min.js',
+}
+
+# GOOGLE FONTS SENDS WOFF2 FONTS TO BROWSERS WHICH SUPPORT THEM
+USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/120.0 Safari/537.36")
+
+BUNDLES = {
+    'vendor.css': ('vendor/bootstrap/bootstrap.min.css',
+                   'vendor/fontawesome/css/all.css',
+                   'vendor/roboto/roboto.css'),
+    'app.css': ('stylesheets/style.css',),
+    'vendor.js': ('vendor/jquery/jquery.min.js',),
+    'app.js': ('scripts/app.js',
+               'scripts/daylog.js',
+               'scripts/daynav.js'),
+}
+
+# RESIZED VERSIONS OF THESE IMAGES ARE BUILT FOR srcset
+RESPONSIVE_IMAGES = ('images/background1.jpg',)
+RESPONSIVE_WIDTHS = (640, 1280, 1920)
+IMAGE_FORMATS = {
+    'avif': ('AVIF', {'quality': 50}),
+    'webp': ('WEBP', {'quality': 70}),
+    'jpg': ('JPEG', {'quality': 75, 'optimize': True, 'progressive': True}),
+}
+
+# FILES WORTH COMPRESSING (FONTS & IMAGES ARE COMPRESSED ALREADY)
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.ttf', '.eot')
+
+# ONE YEAR; BUILT FILE NAMES CHANGE WITH THEIR CONTENT
+CACHE_SECONDS = 365 * 24 * 3600
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+mimetypes.add_type('font/woff2', '.woff2')
+mimetypes.add_type('font/woff', '.woff')
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/avif', '.avif')
+
+
+###########################################################
+# VENDORING:
+
+def download(url):
+
+    req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(req, timeout=30) as response:
+        return response.read()
+
+
+def vendor(progress=None):
+    """
+    Download the VENDOR files & the fonts / images their CSS refers to.
+    Relative references keep their place next to the CSS file, absolute
+    ones go to its fonts/ folder; the CSS is rewritten to point at them.
+    Returns the paths of the written files.
+    """
+
+    written = []
+
+    def save(path, content):
+        full = os.path.join(STATIC_DIR, path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, 'wb') as file:
+            file.write(content)
+        written.append(path)
+        if progress:
+            progress(path)
+
+    for path, url in VENDOR.items():
+        content = download(url)
+
+        if path.endswith('.css'):
+            css = content.decode('utf-8')
+            folder = os.path.dirname(path)
+            fetched = {}
+
+            for ref in {m.group(2) for m in CSS_URL.finditer(css)}:
+                if ref.startswith('data:'):
+                    continue
+
+                source = urllib.parse.urljoin(url, ref)
+                clean = urllib.parse.urlsplit(source)._replace(query='', fragment='').geturl()
+
+                if clean not in fetched:
+                    if urllib.parse.urlsplit(ref).netloc:
+                        local = 'fonts/' + os.path.basename(urllib.parse.urlsplit(clean).path)
+                    else:
+                        local = urllib.parse.urlsplit(ref).path
+                    save(os.path.normpath(os.path.join(folder, local)), download(clean))
+                    fetched[clean] = local
+
+                fragment = urllib.parse.urlsplit(ref).fragment
+                css = css.replace(ref, fetched[clean] + (f"#{fragment}" if fragment else ""))
+
+            content = css.encode('utf-8')
+
+        save(path, content)
+
+    return written
+
+
+###########################################################
+# BUILD:
+
+def fingerprint(name, content):
+    """app.css + content => app.<8 hex digits of its sha256>.css"""
+
+    stem, ext = os.path.splitext(os.path.basename(name))
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:8]}{ext}"
+
+
+class Build:
+    """One run of the asset build into DIST_DIR."""
+
+    def __init__(self, progress=None):
+
+        self.files = {}       # source name => built file name
+        self.srcsets = {}     # image name => {format: [(width, built file name)]}
+        self.skipped = {}     # bundle name => its missing vendor files
+        self.progress = progress
+
+    def write(self, name, content):
+        """Write `content` under its fingerprinted name (& compressed variants)."""
+
+        built = fingerprint(name, content)
+        full = os.path.join(DIST_DIR, built)
+
+        with open(full, 'wb') as file:
+            file.write(content)
+
+        if built.endswith(COMPRESSIBLE):
+            compress(full, content)
+
+        if self.progress:
+            self.progress(built, len(content))
+
+        return built
+
+    def static_file(self, path):
+        """Fingerprint a file under static/ once & return its built name."""
+
+        if path not in self.files:
+            with open(os.path.join(STATIC_DIR, path), 'rb') as file:
+                self.files[path] = self.write(path, file.read())
+
+        return self.files[path]
+
+    def css(self, path):
+        """The CSS of a static/ file with its url()s pointing at built files."""
+
+        with open(os.path.join(STATIC_DIR, path), encoding='utf-8') as file:
+            css = file.read()
+
+        folder = os.path.dirname(path)
+
+        def rewrite(match):
+            ref = match.group(2)
+            parts = urllib.parse.urlsplit(ref)
+
+            if ref.startswith('data:') or parts.scheme or parts.netloc:
+                return match.group(0)
+
+            built = self.static_file(os.path.normpath(os.path.join(folder, parts.path)))
+            return f"url({built}{'#' + parts.fragment if parts.fragment else ''})"
+
+        return CSS_URL.sub(rewrite, css)
+
+    def bundle(self, name, sources):
+        """Concatenate `sources` into one built file."""
+
+        if name.endswith('.css'):
+            content = "\n".join(self.css(source) for source in sources)
+        else:
+            parts = []
+            for source in sources:
+                with open(os.path.join(STATIC_DIR, source), encoding='utf-8') as file:
+                    parts.append(file.read())
+            # A SEMICOLON KEEPS CONCATENATED SCRIPTS APART
+            content = "\n;\n".join(parts)
+
+        self.files[name] = self.write(name, content.encode('utf-8'))
+
+    def responsive_image(self, path):
+        """Resized versions of an image in every IMAGE_FORMATS Pillow can write."""
+
+        from PIL import Image
+
+        with Image.open(os.path.join(STATIC_DIR, path)) as original:
+            original = original.convert('RGB')
+
+            for fmt, (pil_format, options) in IMAGE_FORMATS.items():
+                srcset = []
+
+                for width in RESPONSIVE_WIDTHS:
+                    if width > original.width:
+                        break
+
+                    height = round(original.height * width / original.width)
+                    buffer = io.BytesIO()
+
+                    try:
+                        original.resize((width, height), Image.LANCZOS).save(
+                            buffer, pil_format, **options)
+                    except (KeyError, OSError):
+                        break    # THIS PILLOW CAN'T WRITE THE FORMAT
+
+                    stem = os.path.splitext(path)[0]
+                    srcset.append((width, self.write(f"{stem}-{width}w.{fmt}", buffer.getvalue())))
+
+                if srcset:
+                    self.srcsets.setdefault(path, {})[fmt] = srcset
+
+    def run(self):
+        """
+        Build every asset & write the manifest. Returns the manifest.
+        Bundles missing vendor files are skipped (listed in the manifest);
+        any other missing source raises FileNotFoundError.
+        """
+
+        bundles = {}
+
+        for name, sources in BUNDLES.items():
+            missing = [source for source in sources
+                       if not os.path.exists(os.path.join(STATIC_DIR, source))]
+
+            if any(not source.startswith('vendor/') for source in missing):
+                raise FileNotFoundError(f"Missing sources of {name}: {', '.join(missing)}")
+
+            if missing:
+                self.skipped[name] = missing
+            else:
+                bundles[name] = sources
+
+        shutil.rmtree(DIST_DIR, ignore_errors=True)
+        os.makedirs(DIST_DIR)
+
+        for name, sources in bundles.items():
+            self.bundle(name, sources)
+
+        try:
+            for path in RESPONSIVE_IMAGES:
+                self.responsive_image(path)
+        except ImportError:
+            pass    # NO PILLOW: THE ORIGINAL IMAGES ARE USED
+
+        manifest = {'files': self.files, 'srcsets': self.srcsets, 'skipped': self.skipped}
+
+        with open(MANIFEST, 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+
+        return manifest
+
+
+def compress(full, content):
+    """Write .gz (& .br, with brotli) next to a built file if they are smaller."""
+
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+
+    try:
+        import brotli
+        variants['.br'] = brotli.compress(content, quality=11)
+    except ImportError:
+        pass
+
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(content):
+            with open(full + suffix, 'wb') as file:
+                file.write(compressed)
+
+
+def build(progress=None):
+    """Build the assets into static/dist/. Returns the manifest."""
+
+    return Build(progress).run()
+
+
+###########################################################
+# SERVING:
+
+# PRECOMPRESSED VARIANTS IN THE ORDER OF PREFERENCE
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def load_manifest():
+
+    try:
+        with open(MANIFEST) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def init_app(app):
+    """
+    Serve the built assets at /assets/ & give the templates `asset_built(name)`,
+    `asset_url(name)`, `asset_image(image)` and `asset_srcset(image, format)`.
+    """
+
+    manifest = load_manifest()
+    files = manifest['files'] if manifest else {}
+    srcsets = manifest['srcsets'] if manifest else {}
+    served = set(files.values()) | {built for sets in srcsets.values()
+                                    for srcset in sets.values()
+                                    for _, built in srcset}
+
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        """A built asset, precompressed if the browser accepts it."""
+
+        if filename not in served:
+            abort(404)
+
+        encoding, suffix = next(
+            ((encoding, suffix) for encoding, suffix in ENCODINGS
+             if encoding in request.accept_encodings
+             and os.path.exists(os.path.join(DIST_DIR, filename + suffix))),
+            (None, ''))
+
+        response = send_from_directory(
+            DIST_DIR, filename + suffix,
+            mimetype=mimetypes.guess_type(filename)[0],
+            cache_timeout=CACHE_SECONDS
+        )
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+
+        return response
+
+    def asset_built(name):
+        """Is the bundle `name` built? (Else the page links its sources.)"""
+
+        return name in files
+
+    def asset_url(name):
+        """URL of the built `name`, or of its static/ source without a build."""
+
+        if name in files:
+            return url_for('serve_asset', filename=files[name])
+
+        return url_for('static', filename=name)
+
+    def asset_image(image, fmt='jpg'):
+        """URL of the largest resized `image` in `fmt`, or of its static/
+        source without a build (the <img src> of browsers without srcset)."""
+
+        srcset = srcsets.get(image, {}).get(fmt)
+
+        if srcset:
+            return url_for('serve_asset', filename=srcset[-1][1])
+
+        return url_for('static', filename=image)
+
+    def asset_srcset(image, fmt):
+        """srcset of the resized versions of `image` in `fmt` ('' if not built)."""
+
+        return ", ".join(f"{url_for('serve_asset', filename=built)} {width}w"
+                         for width, built in srcsets.get(image, {}).get(fmt, []))
+
+    app.jinja_env.globals.update(
+        asset_built=asset_built,
+        asset_url=asset_url,
+        asset_image=asset_image,
+        asset_srcset=asset_srcset,
+    )
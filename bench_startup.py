@@ -0,0 +1,91 @@
+"""Startup time & per-request overhead of the app in each config profile
+
+    python bench_startup.py [--runs 5] [--requests 500]
+
+- import: a fresh interpreter imports app.py, which builds the app
+  (what a new gunicorn worker does), median of --runs processes
+- first request: the first request of that process, median too
+- per request: mean time of --requests more requests in one process
+
+The requests GET /login through the test client, which reads no
+database; the partition check of the first request is switched off, so
+no database is needed.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = ('development', 'production')
+
+BENCH_URL = '/login'
+
+# RUN IN A FRESH INTERPRETER; PRINTS THE IMPORT & FIRST REQUEST SECONDS
+COLD_START = f"""
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.config['PARTITIONS_ON_FIRST_REQUEST'] = False
+app.app.test_client().get({BENCH_URL!r})
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def cold_start(profile, runs):
+    """Median (import, first request) seconds of `runs` new processes."""
+
+    env = {**os.environ, 'APP_CONFIG': profile, 'LOG_LEVEL': 'WARNING'}
+    imports, firsts = [], []
+
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', COLD_START], env=env,
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        imported, first = map(float, output.split()[-2:])
+        imports.append(imported)
+        firsts.append(first)
+
+    return statistics.median(imports), statistics.median(firsts)
+
+
+def per_request(profile, requests):
+    """Mean seconds of a request after the first one."""
+
+    from app import create_app
+
+    app = create_app(profile)
+    app.config['PARTITIONS_ON_FIRST_REQUEST'] = False
+    client = app.test_client()
+    client.get(BENCH_URL)
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = client.get(BENCH_URL)
+        assert response.status_code == 200, response.status
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='processes per profile')
+    parser.add_argument('--requests', type=int, default=500, help='requests per profile')
+    args = parser.parse_args()
+
+    os.environ['LOG_LEVEL'] = 'WARNING'
+
+    print(f"{'profile':<14}{'import':>10}{'first request':>16}{'per request':>14}")
+
+    for profile in PROFILES:
+        imported, first = cold_start(profile, args.runs)
+        each = per_request(profile, args.requests)
+
+        print(f"{profile:<14}{imported * 1000:>8.0f}ms{first * 1000:>14.1f}ms{each * 1000:>12.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Response compression of Calorie Counter
+
+HTML, JSON, CSV & other text responses are compressed with brotli (with
+the optional brotli package) or gzip, whichever the browser accepts &
+prefers. Responses under MIN_SIZE bytes are sent as they are; streamed
+responses (the food log exports) are compressed chunk by chunk as they
+are generated. Built static files come precompressed from /assets/
+(see assets.py) & are passed through untouched.
+"""
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# SMALLER BODIES ARE NOT WORTH THE CPU & THE HEADERS
+MIN_SIZE = 500
+
+COMPRESSIBLE = (
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson',
+    'image/svg+xml',
+)
+
+# LEVELS FOR RESPONSES COMPRESSED ON EVERY REQUEST (FAST, MOST OF THE GAIN)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def negotiate():
+    """'br', 'gzip' or None: the best encoding the browser accepts & we have."""
+
+    offered = ('br', 'gzip') if brotli else ('gzip',)
+    best = request.accept_encodings.best_match(offered)
+
+    # best_match FALLS BACK TO THE FIRST OFFER FOR "*" ONLY IF IT IS ACCEPTED
+    return best if best and request.accept_encodings[best] else None
+
+
+def compressor(encoding):
+    """(compress(chunk), finish()) of a stream in `encoding`."""
+
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=BROTLI_QUALITY)
+        return stream.process, stream.finish
+
+    # wbits 16+: A GZIP HEADER & TRAILER AROUND THE DEFLATE STREAM
+    stream = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return stream.compress, stream.flush
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of (str or bytes) chunks as they come."""
+
+    compress, finish = compressor(encoding)
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+
+        data = compress(chunk)
+        if data:
+            yield data
+
+    yield finish()
+
+
+def compress_response(response):
+    """Compress the response if worth it & the browser accepts it."""
+
+    if (response.direct_passthrough                       # SENT FROM A FILE
+            or response.mimetype not in COMPRESSIBLE
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+
+    # THE BODY DEPENDS ON Accept-Encoding, EVEN IF THIS ONE IS NOT COMPRESSED
+    response.vary.add('Accept-Encoding')
+
+    encoding = negotiate()
+    if encoding is None or request.method == 'HEAD':
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+
+        compress, finish = compressor(encoding)
+        response.set_data(compress(data) + finish())
+
+    response.headers['Content-Encoding'] = encoding
+
+    # ANOTHER ENCODING IS ANOTHER REPRESENTATION: THE ETAG IS WEAK NOW
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_app(app):
+    """
+    Compress the app's responses. Call it before any extension that
+    rewrites response bodies (e.g. the debug toolbar): after_request
+    functions run in reverse order, so this one runs last.
+    """
+
+    app.after_request(compress_response)
@@ -0,0 +1,92 @@
+"""Configurations of Calorie Counter
+
+create_app() (app.py) takes one of these classes, or its name in CONFIGS.
+Without one, the APP_CONFIG env var picks it (else FLASK_ENV, else
+"production"):
+
+- development: debug mode, the debug toolbar & DEBUG logs
+- production: no debug machinery, INFO logs
+- testing: production with TESTING on
+"""
+
+import os
+
+import metrics
+from models import REPLICA_BIND
+
+
+def database_url(name, default=None):
+    """A database URL env var, with Heroku's postgres:// scheme fixed."""
+
+    url = os.environ.get(name, default)
+    return url and url.replace("postgres://", "postgresql://", 1)
+
+
+class Config:
+    """Settings of every profile, mostly from env vars."""
+
+    # DATABASE CONNECTION
+    SQLALCHEMY_DATABASE_URI = database_url("DATABASE_URL", "postgresql:///calorie_db")
+
+    # READ REPLICA CONNECTION (OPTIONAL)
+    SQLALCHEMY_BINDS = ({REPLICA_BIND: database_url("DATABASE_REPLICA_URL")}
+                        if os.environ.get("DATABASE_REPLICA_URL") else None)
+
+    # SECONDS A USER READS FROM THE PRIMARY AFTER A WRITE (READ-YOUR-WRITES)
+    REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 10))
+
+    # CONNECTION POOL (DB_POOL_* & DB_PGBOUNCER ENV_VARS, SEE metrics.pool_options)
+    SQLALCHEMY_ENGINE_OPTIONS = metrics.pool_options()
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    SECRET_KEY = os.environ.get("SECRET_KEY", "top_secret")
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+    # LARGEST REQUEST BODY: A WEB IMPORT IS LOADED WITHIN ITS REQUEST, SO
+    # BIGGER FILES GO THROUGH `flask import-logs`
+    MAX_CONTENT_LENGTH = int(os.environ.get("IMPORT_MAX_MB", 16)) * 1024 * 1024
+
+    DEBUG_TOOLBAR = False
+
+    # CREATE THE COMING food_logs PARTITIONS BEFORE THE FIRST REQUEST
+    PARTITIONS_ON_FIRST_REQUEST = True
+
+
+class DevelopmentConfig(Config):
+
+    DEBUG = True
+    DEBUG_TOOLBAR = True
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
+
+
+class ProductionConfig(Config):
+
+    DEBUG = False
+
+    # THE SCHEDULER WORKER KEEPS THE PARTITIONS READY (ensure_partitions JOB),
+    # THE FIRST REQUEST OF EVERY WEB WORKER DOESN'T WAIT FOR IT
+    PARTITIONS_ON_FIRST_REQUEST = False
+
+
+class TestingConfig(ProductionConfig):
+
+    TESTING = True
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
+
+
+def config_from_env():
+    """The config class APP_CONFIG (or FLASK_ENV) names; production by default."""
+
+    name = os.environ.get("APP_CONFIG") or os.environ.get("FLASK_ENV") or "production"
+    return CONFIGS[name]
@@ -0,0 +1,226 @@
+"""Export of food logs
+
+- a user's food logs as CSV & JSON lines (the CSV can be imported back)
+- all food logs as columnar files (Parquet / Arrow) for analytics
+
+The logs are read through a server-side cursor and written out in
+batches, so a long history is never held in memory at once.
+"""
+
+import csv
+import io
+import json
+import os
+
+from models import db, Food, FoodServing, FoodLog
+
+# ROWS FETCHED FROM THE CURSOR (AND WRITTEN OUT) AT A TIME
+BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = (
+    'date', 'food', 'brand', 'serving', 'amount', 'calories',
+    'carbohydrate', 'fat', 'protein', 'food_id', 'serving_id'
+)
+
+
+def export_rows(user_id, batch_size=BATCH_SIZE):
+    """Yield the user's food logs as tuples of EXPORT_COLUMNS, oldest first."""
+
+    # NUTRIENTS OF THE SERVING SCALED TO THE EATEN AMOUNT
+    portion = FoodLog.amount / FoodLog.number_of_units
+
+    query = (
+        db.session.query(
+            FoodLog.date,
+            Food.name,
+            Food.brand,
+            FoodLog.serving_description,
+            FoodLog.amount,
+            FoodLog.calories,
+            FoodServing.carbohydrate * portion,
+            FoodServing.fat * portion,
+            FoodServing.protein * portion,
+            FoodLog.food_id,
+            FoodLog.serving_id)
+        .join(Food, Food.id == FoodLog.food_id)
+        .outerjoin(FoodServing, FoodServing.serving_id == FoodLog.serving_id)
+        .filter(FoodLog.user_id == user_id)
+        .order_by(FoodLog.date, FoodLog.id)
+        .yield_per(batch_size)
+    )
+
+    for row in query:
+        yield (row[0].isoformat(), *row[1:5],
+               *(_rounded(value) for value in row[5:9]),
+               *row[9:])
+
+
+def _rounded(value):
+
+    return None if value is None else round(value, 2)
+
+
+def csv_export(rows, batch_size=BATCH_SIZE):
+    """Yield CSV text (header first) in pieces of `batch_size` rows."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def ndjson_export(rows, batch_size=BATCH_SIZE):
+    """Yield JSON lines (one object per log) in pieces of `batch_size` rows."""
+
+    lines = []
+
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+
+        if len(lines) == batch_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_export, 'text/csv'),
+    'ndjson': (ndjson_export, 'application/x-ndjson'),
+}
+
+
+###########################################################
+# COLUMNAR EXPORT (NEEDS pyarrow):
+
+# ROWS FETCHED FROM THE CURSOR AT A TIME & MAX ROWS PER FILE
+COLUMNAR_BATCH_SIZE = 50000
+
+# FLOAT NUTRIENT COLUMNS OF food_servings, SCALED TO THE EATEN AMOUNT
+NUTRIENTS = (
+    'carbohydrate', 'sugar', 'fiber', 'fat', 'saturated_fat',
+    'monounsaturated_fat', 'polyunsaturated_fat', 'trans_fat', 'protein',
+    'cholesterol', 'sodium', 'potassium', 'iron', 'vitamin_a', 'vitamin_c'
+)
+
+
+def columnar_schema(pa):
+    """Arrow schema of the columnar export."""
+
+    return pa.schema(
+        [('log_id', pa.int32()),
+         ('user_id', pa.int32()),
+         ('date', pa.date32()),
+         ('food_id', pa.int32()),
+         ('food', pa.string()),
+         ('brand', pa.string()),
+         ('serving_id', pa.int32()),
+         ('serving', pa.string()),
+         ('amount', pa.float64()),
+         ('number_of_units', pa.float64()),
+         ('calories', pa.float64())]
+        + [(nutrient, pa.float64()) for nutrient in NUTRIENTS]
+    )
+
+
+def columnar_export(out_dir, fmt='parquet', user_id=None,
+                    batch_size=COLUMNAR_BATCH_SIZE, progress=None):
+    """
+    Write the food logs (of one user, or everyone) with their food &
+    nutrient columns into `out_dir/month=YYYY-MM/part-NNNNN.<fmt>` files.
+    Rows are fetched in batches straight into column lists, no ORM objects.
+    `fmt` is 'parquet' or 'arrow' (Arrow IPC / Feather v2).
+    Returns the number of written rows.
+    """
+
+    import pyarrow as pa
+
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        write = pq.write_table
+    else:
+        import pyarrow.feather as feather
+        write = feather.write_feather
+
+    schema = columnar_schema(pa)
+    portion = FoodLog.amount / FoodLog.number_of_units
+
+    statement = (
+        db.select(
+            FoodLog.id,
+            FoodLog.user_id,
+            FoodLog.date,
+            FoodLog.food_id,
+            Food.name,
+            Food.brand,
+            FoodLog.serving_id,
+            FoodLog.serving_description,
+            FoodLog.amount,
+            FoodLog.number_of_units,
+            FoodLog.calories,
+            *(getattr(FoodServing, nutrient) * portion for nutrient in NUTRIENTS))
+        .join(Food, Food.id == FoodLog.food_id)
+        .outerjoin(FoodServing, FoodServing.serving_id == FoodLog.serving_id)
+        .order_by(FoodLog.date, FoodLog.id)
+        .execution_options(stream_results=True)
+    )
+
+    if user_id is not None:
+        statement = statement.where(FoodLog.user_id == user_id)
+
+    columns = [[] for _ in schema]
+    month = None
+    part = 0
+    written = 0
+
+    def flush():
+        nonlocal columns, part, written
+
+        if not columns[0]:
+            return
+
+        folder = os.path.join(out_dir, f"month={month}")
+        os.makedirs(folder, exist_ok=True)
+
+        table = pa.Table.from_arrays(
+            [pa.array(column, type=field.type)
+             for column, field in zip(columns, schema)],
+            schema=schema
+        )
+        write(table, os.path.join(folder, f"part-{part:05d}.{fmt}"))
+
+        written += table.num_rows
+        part += 1
+        columns = [[] for _ in schema]
+
+        if progress:
+            progress(written)
+
+    result = db.session.execute(statement)
+
+    for rows in result.partitions(batch_size):
+        for row in rows:
+            row_month = row[2].strftime("%Y-%m")
+
+            if row_month != month or len(columns[0]) >= batch_size:
+                flush()
+                if row_month != month:
+                    month = row_month
+                    part = 0
+
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    flush()
+
+    return written
@@ -0,0 +1,109 @@
+"""Cache of rendered page fragments of Calorie Counter
+
+Parts of pages which are the same for every user (e.g. a page of
+Fatsecret search results) are rendered once & kept in the memory of
+the worker process for a while:
+
+    html = search_cache.get(key)
+    if html is None:
+        html = render_template(...)
+        search_cache.set(key, html)
+
+Entries expire after `ttl` seconds; when the cached text outgrows
+`max_bytes` the least recently used entries are dropped first.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+
+class FragmentCache:
+    """Thread-safe LRU cache of rendered fragments with a TTL & a size bound."""
+
+    def __init__(self, name, ttl, max_bytes):
+
+        self.name = name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key => (expires, size, value), oldest use first
+        self.size = 0
+
+    def get(self, key):
+        """The cached value of `key`, or None if missing or expired."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[0] <= now:
+                self._drop(key)
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        metrics.inc("fragment_cache_hits_total" if entry else "fragment_cache_misses_total",
+                    cache=self.name)
+
+        return entry[2] if entry else None
+
+    def set(self, key, value, size=None):
+        """Cache `value` (a string, or anything of the given `size`) under `key`."""
+
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                metrics.inc("fragment_cache_evictions_total", cache=self.name)
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def _drop(self, key):
+
+        self.size -= self._entries.pop(key)[1]
+
+
+_caches = []
+
+
+def fragment_cache(name, ttl, max_bytes):
+    """A new FragmentCache, with its size on /metrics."""
+
+    cache = FragmentCache(name, ttl, max_bytes)
+    _caches.append(cache)
+    return cache
+
+
+def _cache_gauges():
+    """Entries & bytes held by each fragment cache."""
+
+    for cache in _caches:
+        labels = {"cache": cache.name}
+        yield "fragment_cache_entries", labels, len(cache)
+        yield "fragment_cache_bytes", labels, cache.size
+
+
+metrics.gauge(_cache_gauges)
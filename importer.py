@@ -0,0 +1,215 @@
+"""Bulk import of food logs from other trackers (CSV or JSON lines)
+
+Each row needs a `date` (YYYY-MM-DD) and an `amount`, plus the food as
+`food_id` or `food` (its name) and optionally the serving as `serving_id`
+or `serving` (its description, e.g. "100 g"). This is the format of the
+CSV export, so exported logs can be imported back.
+
+Rows are read & loaded in chunks: the foods of a chunk are resolved
+against the local catalog with one query, and the chunk is loaded into
+food_logs with Postgres COPY. Memory use doesn't grow with the file.
+"""
+
+import csv
+import io
+import json
+import math
+from datetime import date, timedelta
+from itertools import islice
+
+from models import db, Food, FoodServing, ensure_food_log_partitions
+
+# ROWS PER COPY (AND PER COMMIT)
+CHUNK_SIZE = 5000
+
+# ROWS DATED BEFORE THIS OR MORE THAN A YEAR AHEAD ARE SKIPPED, THEY ARE
+# TYPOS & EVERY MONTH WOULD GET A food_logs PARTITION
+OLDEST_DATE = date(1900, 1, 1)
+MAX_DAYS_AHEAD = 366
+
+COPY_COLUMNS = (
+    'user_id', 'food_id', 'serving_id', 'serving_description',
+    'unit_calories', 'amount', 'number_of_units', 'calories', 'date'
+)
+
+
+def read_rows(stream, fmt):
+    """Yield the rows of a CSV or JSON lines text stream one by one.
+    A line which is not a JSON object comes as an empty row (skipped)."""
+
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+
+    else:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = {}
+
+            yield row if isinstance(row, dict) else {}
+
+
+def in_chunks(rows, size):
+    """Yield lists of at most `size` rows."""
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class CatalogResolver:
+    """
+    Finds the local food & serving of import rows.
+    Foods are looked up once per chunk for all of its unseen names & ids;
+    what was found is kept, so the cache grows with the number of
+    distinct foods, not with the number of rows.
+    """
+
+    def __init__(self):
+
+        self.food_ids = {}    # food name => food id
+        self.servings = {}    # food id => [(serving_id, description, calories, number_of_units)]
+
+    def load(self, rows):
+        """Look up the foods of `rows` which are not cached yet."""
+
+        names = {row['food'] for row in rows
+                 if not row.get('food_id') and row.get('food')} - set(self.food_ids)
+
+        if names:
+            for food_id, name in (db.session.query(Food.id, Food.name)
+                                             .filter(Food.name.in_(names))):
+                self.food_ids[name] = food_id
+
+        ids = {self.food_id(row) for row in rows} - set(self.servings) - {None}
+
+        if ids:
+            for food_id in ids:
+                self.servings[food_id] = []
+
+            for serving in (db.session.query(FoodServing.food_id,
+                                             FoodServing.serving_id,
+                                             FoodServing.serving_description,
+                                             FoodServing.calories,
+                                             FoodServing.number_of_units)
+                                      .filter(FoodServing.food_id.in_(ids))):
+                self.servings[serving[0]].append(serving[1:])
+
+    def food_id(self, row):
+        """The food id of a row, or None if it is unknown."""
+
+        if row.get('food_id'):
+            try:
+                return int(row['food_id'])
+            except ValueError:
+                return None
+
+        return self.food_ids.get(row.get('food'))
+
+    def serving(self, row):
+        """
+        (food_id, serving) of a row, or None if the food or the serving
+        is not in the local catalog. Without a serving, '100 g' or the
+        first serving of the food is used.
+        """
+
+        food_id = self.food_id(row)
+        servings = self.servings.get(food_id)
+
+        if not servings:
+            return None
+
+        if row.get('serving_id'):
+            found = [s for s in servings if str(s[0]) == str(row['serving_id'])]
+
+        elif row.get('serving'):
+            wanted = row['serving'].strip().lower()
+            found = [s for s in servings if (s[1] or '').lower() == wanted]
+
+        else:
+            found = ([s for s in servings if s[1] == '100 g'] or servings)[:1]
+
+        return (food_id, found[0]) if found else None
+
+
+def import_logs(user_id, stream, fmt='csv', chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Load the food logs of a CSV / JSON lines text stream for the user.
+    Every chunk is committed on its own; `progress(imported, skipped)`
+    is called after each one.
+    Returns {'imported': ..., 'skipped': ...}.
+    """
+
+    resolver = CatalogResolver()
+    imported = skipped = 0
+    latest = date.today() + timedelta(days=MAX_DAYS_AHEAD)
+
+    for chunk in in_chunks(read_rows(stream, fmt), chunk_size):
+        resolver.load(chunk)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        dates = []
+
+        for row in chunk:
+            found = resolver.serving(row)
+
+            try:
+                the_date = date.fromisoformat(str(row['date']).strip())
+                amount = float(row['amount'])
+                food_id, (serving_id, description, unit_calories, units) = found
+                number_of_units = float(units)
+                calories = unit_calories * amount / number_of_units
+
+                # A NULL WOULD FAIL THE COPY OF THE WHOLE CHUNK
+                if not description:
+                    raise ValueError("No serving description")
+
+                if not OLDEST_DATE <= the_date <= latest:
+                    raise ValueError("Date out of range")
+
+                if not (amount > 0 and math.isfinite(amount)):
+                    raise ValueError("Amount must be positive")
+
+            except (KeyError, TypeError, ValueError, ZeroDivisionError):
+                skipped += 1
+                continue
+
+            writer.writerow((user_id, food_id, serving_id, description,
+                             unit_calories, amount, number_of_units,
+                             calories, the_date.isoformat()))
+            dates.append(the_date)
+
+        if dates:
+            connection = db.session.connection()
+            ensure_food_log_partitions(connection, dates=dates)
+
+            buffer.seek(0)
+            with connection.connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY food_logs ({', '.join(COPY_COLUMNS)}) "
+                    f"FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+
+            db.session.commit()
+            imported += len(dates)
+
+        if progress:
+            progress(imported, skipped)
+
+    return {'imported': imported, 'skipped': skipped}
+
+
+def file_format(filename):
+    """'csv' or 'json' (JSON lines) by the file extension."""
+
+    return 'csv' if filename.lower().endswith('.csv') else 'json'
@@ -0,0 +1,231 @@
+"""Background jobs of Calorie Counter
+
+Slow, non-interactive work (catalog ingestion & revalidation, catalog
+warming, summary rebuilds, partition upkeep) is queued in the `jobs`
+table and run by `flask worker` processes, outside of the request path:
+
+    Job.enqueue('ingest_food', {'food_id': 1234}, key='ingest_food:1234')
+
+A worker claims one due job at a time (FOR UPDATE SKIP LOCKED, so any
+number of workers can run), holds it for JOB_TIMEOUT seconds and retries
+a failing job with exponential backoff until its max_attempts.
+With --scheduler a worker also queues the PERIODIC_JOBS.
+"""
+
+import logging
+import time
+import traceback
+from datetime import date, datetime
+
+import schedule
+from sqlalchemy.exc import IntegrityError
+
+from models import (db, Food, UserFood, Job, as_list,
+                    ensure_food_log_partitions, add_months, PARTITION_MONTHS_AHEAD)
+
+logger = logging.getLogger(__name__)
+
+# SECONDS A CLAIMED JOB IS INVISIBLE TO OTHER WORKERS (VISIBILITY TIMEOUT)
+JOB_TIMEOUT = 300
+
+# FIRST RETRY DELAY IN SECONDS, DOUBLED ON EVERY FURTHER ATTEMPT
+RETRY_BACKOFF = 30
+
+# SECONDS TO SLEEP WHEN THE QUEUE IS EMPTY
+POLL_INTERVAL = 2.0
+
+# FOODS OF A WARMED SEARCH TERM, QUEUED FOR INGESTION
+WARM_RESULTS = 20
+
+# LEAST RECENTLY REFRESHED FOODS RE-FETCHED PER revalidate_foods JOB,
+# WITH A PAUSE (SECONDS) BETWEEN FATSECRET CALLS TO SPARE THE API QUOTA
+REVALIDATE_BATCH = 50
+REVALIDATE_PAUSE = 1.0
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the function running the jobs of `kind`."""
+
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+def fatsecret():
+    """The Fatsecret client of the app (imported late, the app imports this module)."""
+
+    from app import get_fatsecret
+    return get_fatsecret()
+
+
+def skip_food(food_id):
+    """Mark the food refreshed, so revalidation goes on with the next ones.
+    An UPDATE by id: the food may be deleted meanwhile."""
+
+    db.session.execute(db.update(Food.__table__)
+                         .where(Food.id == food_id)
+                         .values(refreshed_at=datetime.utcnow()))
+    db.session.commit()
+
+
+###########################################################
+# HANDLERS (EACH GETS THE JOB PAYLOAD, THE WORKER COMMITS):
+
+@handler('ingest_food')
+def ingest_food(payload):
+    """Save a food & its servings to the local catalog.
+    The payload has the Fatsecret `food` already, or just its `food_id`."""
+
+    food = payload.get('food') or fatsecret().food_get(payload['food_id'])
+    Food.revalidate(food)
+
+
+@handler('warm_catalog')
+def warm_catalog(payload):
+    """Queue the ingestion of the foods a Fatsecret search of `term` finds,
+    so the local search has them."""
+
+    results = fatsecret().foods_search(payload['term'], max_results=WARM_RESULTS)
+
+    for result in as_list(results or []):
+        Job.enqueue('ingest_food', {'food_id': int(result['food_id'])},
+                    key=f"ingest_food:{result['food_id']}")
+
+
+@handler('revalidate_foods')
+def revalidate_foods(payload):
+    """Re-fetch the least recently refreshed foods & store what changed.
+    Each food is committed on its own; a food Fatsecret can't return, or
+    renamed to the name of another food, is skipped until its next turn."""
+
+    food_ids = Food.stale(payload.get('limit', REVALIDATE_BATCH))
+    failures = 0
+
+    for food_id in food_ids:
+        try:
+            changed = Food.revalidate(fatsecret().food_get(food_id))
+            db.session.commit()
+            logger.info("Food #%s revalidated, %s row(s) changed", food_id, changed)
+
+        except IntegrityError:
+            # ANOTHER FOOD TOOK ITS NEW NAME MEANWHILE (Food.name IS UNIQUE)
+            db.session.rollback()
+            logger.warning("Food #%s was renamed to the name of another food", food_id,
+                           exc_info=True)
+            skip_food(food_id)
+            failures += 1
+
+        except Exception:
+            db.session.rollback()
+            logger.warning("Food #%s could not be revalidated", food_id, exc_info=True)
+            skip_food(food_id)
+            failures += 1
+
+        time.sleep(payload.get('pause', REVALIDATE_PAUSE))
+
+    if food_ids and failures == len(food_ids):
+        raise RuntimeError("No food could be revalidated")
+
+
+@handler('refresh_popularity')
+def refresh_popularity(payload):
+    """Recount the food popularity of the local search ranking."""
+
+    Food.refresh_popularity()
+
+
+@handler('rebuild_user_foods')
+def rebuild_user_foods(payload):
+    """Recount every user's logged foods."""
+
+    UserFood.rebuild()
+
+
+@handler('ensure_partitions')
+def ensure_partitions(payload):
+    """Create the food_logs partitions of the coming months."""
+
+    last = add_months(date.today(), payload.get('ahead', PARTITION_MONTHS_AHEAD))
+    ensure_food_log_partitions(db.session.connection(), last=last)
+
+
+###########################################################
+# PERIODIC JOBS (QUEUED BY THE WORKER STARTED WITH --scheduler):
+
+PERIODIC_JOBS = (
+    (schedule.every().hour, 'revalidate_foods'),
+    (schedule.every().day.at("03:00"), 'refresh_popularity'),
+    (schedule.every().monday.at("03:30"), 'rebuild_user_foods'),
+    (schedule.every().day.at("04:00"), 'ensure_partitions'),
+)
+
+
+def schedule_periodic_jobs():
+    """Queue the periodic jobs on their schedule (one queued job per kind)."""
+
+    def enqueue(kind):
+        Job.enqueue(kind, key=kind)
+        db.session.commit()
+
+    for every, kind in PERIODIC_JOBS:
+        every.do(enqueue, kind)
+
+
+###########################################################
+# WORKER:
+
+def run_job(job):
+    """Run one claimed job & record how it went. Returns True if it succeeded."""
+
+    func = HANDLERS.get(job.kind)
+
+    try:
+        if func is None:
+            raise LookupError(f"No handler for {job.kind} jobs")
+        if job.attempts > job.max_attempts:
+            raise RuntimeError("Timed out on its last attempt")
+
+        func(job.payload)
+
+    except Exception:
+        db.session.rollback()
+        logger.exception("Job #%s (%s) failed", job.id, job.kind)
+
+        job.fail(traceback.format_exc(limit=5), RETRY_BACKOFF)
+        db.session.commit()
+        return False
+
+    job.finish()
+    db.session.commit()
+    return True
+
+
+def run_worker(once=False, scheduler=False, poll_interval=POLL_INTERVAL):
+    """
+    Claim & run due jobs until stopped. `once`: stop when the queue is empty.
+    Returns the number of jobs run.
+    """
+
+    if scheduler:
+        schedule_periodic_jobs()
+
+    count = 0
+
+    while True:
+        if scheduler:
+            schedule.run_pending()
+
+        job = Job.claim(JOB_TIMEOUT)
+
+        if job is None:
+            if once:
+                return count
+            time.sleep(poll_interval)
+            continue
+
+        run_job(job)
+        count += 1
@@ -0,0 +1,192 @@
+"""In-process metrics for Calorie Counter, served at /metrics"""
+
+import os
+import threading
+import time
+import weakref
+
+from flask import Response, request, abort
+from sqlalchemy.pool import QueuePool, NullPool
+
+
+class Metrics:
+    """
+    Thread-safe counters & summaries of one worker process.
+    Rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.summaries = {}
+        self.gauges = []
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one observation (count, sum & max) of a summary."""
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total, peak = self.summaries.get(key, (0, 0.0, 0.0))
+            self.summaries[key] = (count + 1, total + value, max(peak, value))
+
+    def gauge(self, func):
+        """Register `func`, which yields (name, labels, value) at render time."""
+
+        self.gauges.append(func)
+
+    def render(self):
+        """All the metrics in the Prometheus text format."""
+
+        lines = []
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            summaries = sorted(self.summaries.items())
+
+        for (name, labels), value in counters:
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), (count, total, peak) in summaries:
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_max{_labels(labels)} {peak:.6f}")
+
+        for func in self.gauges:
+            for name, labels, value in func():
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    """(('pool', 'x'),) => {pool="x"}"""
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+metrics = Metrics()
+
+
+###########################################################
+# CONNECTION POOL METRICS:
+
+_pools = weakref.WeakSet()
+
+
+class MeteredPoolMixin:
+    """
+    Times every connection checkout of the pool & counts the checkouts
+    that had to wait for a connection or were served from the overflow.
+    The pool is labelled with its `pool_logging_name`.
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        _pools.add(self)
+
+    @property
+    def metrics_label(self):
+
+        return self._orig_logging_name or "default"
+
+    def _do_get(self):
+
+        label = self.metrics_label
+        waits = (isinstance(self, QueuePool)
+                 and self.checkedin() == 0
+                 and self._max_overflow > -1
+                 and self._overflow >= self._max_overflow)
+        start = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+
+        except Exception:
+            metrics.inc("db_pool_checkout_errors_total", pool=label)
+            raise
+
+        metrics.observe("db_pool_checkout_seconds",
+                        time.perf_counter() - start, pool=label)
+        metrics.inc("db_pool_checkouts_total", pool=label)
+
+        if waits:
+            metrics.inc("db_pool_waits_total", pool=label)
+
+        if isinstance(self, QueuePool) and self._overflow > 0:
+            metrics.inc("db_pool_overflow_checkouts_total", pool=label)
+
+        return connection
+
+
+class MeteredQueuePool(MeteredPoolMixin, QueuePool):
+    """QueuePool with checkout metrics."""
+
+
+class MeteredNullPool(MeteredPoolMixin, NullPool):
+    """NullPool (a new connection per checkout) with checkout metrics."""
+
+
+def _pool_gauges():
+    """Size, checked out connections & overflow in use of each pool."""
+
+    for pool in list(_pools):
+        if isinstance(pool, QueuePool):
+            labels = {"pool": pool.metrics_label}
+            yield "db_pool_size", labels, pool.size()
+            yield "db_pool_checked_out", labels, pool.checkedout()
+            yield "db_pool_overflow", labels, max(pool.overflow(), 0)
+
+
+metrics.gauge(_pool_gauges)
+
+
+def pool_options(environ=os.environ):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the connection pool, from the environment:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds),
+    DB_POOL_RECYCLE (seconds), DB_POOL_PRE_PING (1/0)
+    DB_PGBOUNCER=1: PgBouncer in transaction pooling mode owns the pool,
+    so every checkout opens a new (cheap) PgBouncer connection.
+    """
+
+    if environ.get("DB_PGBOUNCER") == "1":
+        return {"poolclass": MeteredNullPool}
+
+    return {
+        "poolclass": MeteredQueuePool,
+        "pool_size": int(environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(environ.get("DB_POOL_TIMEOUT", 30)),
+        "pool_recycle": int(environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": environ.get("DB_POOL_PRE_PING", "1") == "1",
+    }
+
+
+###########################################################
+# METRICS ENDPOINT:
+
+def init_app(app):
+    """Serve the metrics at /metrics (guarded by METRICS_TOKEN if set)."""
+
+    @app.route('/metrics')
+    def show_metrics():
+        """Metrics of this worker in the Prometheus text format."""
+
+        token = app.config.get("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            abort(403)
+
+        return Response(metrics.render(), mimetype="text/plain")
@@ -1,10 +1,53 @@
 """SQLAlchemy models for Calorie Counter"""
-from flask import Flask
-from datetime import date
-from flask_sqlalchemy import SQLAlchemy
+import re
+from flask import Flask, g, has_app_context
+from datetime import date, datetime, timedelta
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event, text, orm
+from sqlalchemy.dialects.postgresql import insert
 
-db = SQLAlchemy()
+# SQLALCHEMY_BINDS KEY OF THE (OPTIONAL) READ REPLICA
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the SELECTs of read-only views to the read replica.
+    A view opts in by setting `g.use_replica`; writes, flushes and
+    raw connections always go to the primary database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, *args, **kwargs):
+
+        if (not self._flushing
+                and clause is not None and clause.is_select
+                and has_app_context() and g.get('use_replica')
+                and REPLICA_BIND in (self.app.config['SQLALCHEMY_BINDS'] or {})):
+            return db.get_engine(self.app, bind=REPLICA_BIND)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension using the RoutingSession."""
+
+    def create_session(self, options):
+
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        """Name each pool after its server, to tell them apart in the metrics."""
+
+        engine_opts.setdefault(
+            'pool_logging_name',
+            f"{sa_url.host or 'localhost'}:{sa_url.port or 5432}/{sa_url.database}"
+        )
+
+        return super().create_engine(sa_url, engine_opts)
+
+
+db = RoutingSQLAlchemy()
 
 bcrypt = Bcrypt()
 
@@ -13,13 +56,28 @@ bcrypt = Bcrypt()
 
 
 class FoodLog(db.Model):
-    """Each food consumption entry."""
+    """Each food consumption entry.
+    The table is range partitioned by month on `date`
+    (see ensure_food_log_partitions).
+    """
 
     __tablename__ = 'food_logs'
 
+    __table_args__ = (
+        # A PARTITIONED TABLE'S PRIMARY KEY MUST INCLUDE THE PARTITION KEY
+        db.PrimaryKeyConstraint('id', 'date'),
+
+        # INDEXES ON THE PARENT ARE CREATED ON EVERY PARTITION:
+        # BTREE FOR THE DAY VIEWS, BRIN FOR DATE RANGE SCANS
+        db.Index('ix_food_logs_user_id_date', 'user_id', 'date'),
+        db.Index('ix_food_logs_date_brin', 'date', postgresql_using='brin'),
+
+        {'postgresql_partition_by': 'RANGE (date)'}
+    )
+
     id = db.Column(
         db.Integer,
-        primary_key = True
+        autoincrement=True
     )
     
     user_id = db.Column(
@@ -73,6 +131,151 @@ class FoodLog(db.Model):
         default=date.today().isoformat()
     )
 
+    # THE ORM STILL IDENTIFIES A LOG BY ITS id ONLY
+    __mapper_args__ = {'primary_key': [id]}
+
+    @classmethod
+    def for_range(cls, user_id, first, last):
+        """
+        The user's logs from `first` to `last` (inclusive) with their
+        foods, in one query (the (user_id, date) index) ordered by date.
+        """
+
+        return (cls.query
+                   .join(Food, Food.id == cls.food_id)
+                   .options(orm.contains_eager(cls.food))
+                   .filter(cls.user_id == user_id,
+                           cls.date >= first,
+                           cls.date <= last)
+                   .order_by(cls.date, cls.id)
+                   .all())
+
+    def to_dict(self):
+        """The food log for the JSON API."""
+
+        return {
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'food_id': self.food_id,
+            'food_name': self.food.name,
+            'brand_name': self.food.brand,
+            'serving_id': self.serving_id,
+            'serving_description': self.serving_description,
+            'amount': self.amount,
+            'number_of_units': self.number_of_units,
+            'unit_calories': self.unit_calories,
+            'calories': round(self.calories, 2),
+        }
+
+    @classmethod
+    def insert_many(cls, logs):
+        """Insert unsaved FoodLog objects with one multi-row INSERT. Not committed."""
+
+        if not logs:
+            return
+
+        columns = [c.name for c in cls.__table__.columns if c.name != 'id']
+
+        db.session.execute(
+            db.insert(cls.__table__).values(
+                [{name: getattr(log, name) for name in columns} for log in logs]
+            )
+        )
+
+    @classmethod
+    def update_amounts(cls, user_id, amounts):
+        """
+        Set the amounts ({log id: amount}) of the user's logs with one
+        UPDATE, recalculating the calories in SQL. Not committed.
+        Returns the number of updated logs.
+        """
+
+        if not amounts:
+            return 0
+
+        amount = db.case(amounts, value=cls.id)
+
+        result = db.session.execute(
+            db.update(cls.__table__)
+              .where(cls.user_id == user_id, cls.id.in_(list(amounts)))
+              .values(amount=amount,
+                      calories=cls.unit_calories * amount / cls.number_of_units)
+        )
+
+        return result.rowcount
+
+    @classmethod
+    def delete_many(cls, user_id, log_ids):
+        """
+        Delete the user's logs of `log_ids` with one DELETE. Not committed.
+        Returns the number of deleted logs.
+        """
+
+        if not log_ids:
+            return 0
+
+        result = db.session.execute(
+            db.delete(cls.__table__)
+              .where(cls.user_id == user_id, cls.id.in_(log_ids))
+        )
+
+        return result.rowcount
+
+    @classmethod
+    def copy_entries(cls, user_id, from_date, to_date, days=1, log_ids=None):
+        """
+        Copy the user's logs of `days` days starting at `from_date` (only
+        `log_ids` of them, if given) to the same days from `to_date` on,
+        with one INSERT ... SELECT. Not committed.
+        Returns the number of copied logs.
+        """
+
+        shift = (to_date - from_date).days
+        columns = [c for c in cls.__table__.columns if c.name != 'id']
+
+        source = (
+            db.select(*[(c + shift).label('date') if c.name == 'date' else c
+                        for c in columns])
+              .where(cls.user_id == user_id,
+                     cls.date >= from_date,
+                     cls.date < from_date + timedelta(days=days))
+              .order_by(cls.date, cls.id)
+        )
+
+        if log_ids:
+            source = source.where(cls.id.in_(log_ids))
+
+        return db.session.execute(
+            db.insert(cls.__table__).from_select([c.name for c in columns], source)
+        ).rowcount
+
+    @classmethod
+    def from_serving(cls, user_id, food_id, serving, amount, the_date):
+        """
+        Build a food log from a serving & the eaten amount.
+        `serving` is a Fatsecret serving dict or a FoodServing row.
+        """
+
+        if isinstance(serving, FoodServing):
+            serving = {key: getattr(serving, key)
+                       for key in ('serving_id', 'serving_description',
+                                   'calories', 'number_of_units')}
+
+        unit_calories = float(serving['calories'])
+        number_of_units = float(serving['number_of_units'])
+
+        return cls(
+            user_id=user_id,
+            food_id=food_id,
+            serving_id=int(serving['serving_id']),
+            serving_description=serving['serving_description'],
+            unit_calories=unit_calories,
+            amount=amount,
+            number_of_units=number_of_units,
+            calories=unit_calories * amount / number_of_units,
+            date=the_date,
+        )
+
 
 class Food(db.Model):
     """Info of the foods."""
@@ -101,6 +304,19 @@ class Food(db.Model):
         db.Text,        
     )
 
+    # HOW MANY TIMES THE FOOD IS LOGGED BY ALL USERS (SEE refresh_popularity)
+    popularity = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0'
+    )
+
+    # LAST TIME THE FOOD & ITS SERVINGS WERE CHECKED AGAINST FATSECRET
+    refreshed_at = db.Column(
+        db.DateTime
+    )
+
     food_log = db.relationship('FoodLog', 
                                 backref='food',
                                 # cascade="all, delete"
@@ -110,6 +326,200 @@ class Food(db.Model):
 
         return f"Food Name: {self.name} | Type: {self.brand}"
 
+    @classmethod
+    def search(cls, term, page_number=0, max_results=20):
+        """
+        Search the local food catalog by name & brand.
+        Full text (word prefix) matches & similar names (pg_trgm) are
+        ranked by relevance times popularity.
+        Returns (results, last_page); results are shaped like the
+        Fatsecret foods_search results.
+        """
+
+        words = re.findall(r"\w+", term.lower())
+        if not words:
+            return [], True
+
+        # MUST MATCH THE EXPRESSION OF THE ix_foods_search INDEX
+        document = db.func.to_tsvector(SEARCH_CONFIG, cls.name + ' ' + cls.brand)
+        query = db.func.to_tsquery(SEARCH_CONFIG, ' & '.join(f"{w}:*" for w in words))
+
+        relevance = db.func.ts_rank(document, query) + db.func.similarity(cls.name, term)
+
+        foods = (cls.query
+                    .filter(db.or_(document.op('@@')(query),
+                                   cls.name.op('%')(term)))
+                    .order_by((relevance * db.func.ln(cls.popularity + 2)).desc(),
+                              cls.id)
+                    .offset(page_number * max_results)
+                    .limit(max_results + 1)
+                    .all())
+
+        last_page = len(foods) <= max_results
+        foods = foods[:max_results]
+
+        # ONE SERVING TO DESCRIBE EACH FOOD: 100 g IF THERE IS
+        servings = {}
+        for serving in (FoodServing.query
+                            .filter(FoodServing.food_id.in_([f.id for f in foods]))
+                            .order_by(FoodServing.serving_description != '100 g',
+                                      FoodServing.serving_id)):
+            servings.setdefault(serving.food_id, serving)
+
+        return [food.to_search_result(servings.get(food.id)) for food in foods], last_page
+
+    def to_search_result(self, serving=None):
+        """The food as a Fatsecret foods_search result."""
+
+        description = ""
+        if serving:
+            description = (f"Per {serving.serving_description} - "
+                           f"Calories: {serving.calories or 0:g}kcal | "
+                           f"Fat: {serving.fat or 0:.2f}g | "
+                           f"Carbs: {serving.carbohydrate or 0:.2f}g | "
+                           f"Protein: {serving.protein or 0:.2f}g")
+
+        return {
+            'food_id': str(self.id),
+            'food_name': self.name,
+            'food_type': "Generic" if self.brand == "Generic" else "Brand",
+            'brand_name': self.brand,
+            'food_url': self.food_url,
+            'food_description': description,
+        }
+
+    def to_payload(self):
+        """The food & its stored servings as a Fatsecret food_get result."""
+
+        return {
+            **self.to_search_result(),
+            'servings': {'serving': [s.to_payload() for s in self.food_serving]},
+        }
+
+    def is_fresh(self, max_age):
+        """Was the food refreshed within `max_age` (a timedelta)?"""
+
+        return (self.refreshed_at is not None
+                and datetime.utcnow() - self.refreshed_at < max_age)
+
+    @classmethod
+    def stale(cls, limit):
+        """The ids of the `limit` least recently refreshed foods (never refreshed first)."""
+
+        return [food_id for food_id, in
+                db.session.query(cls.id)
+                          .order_by(cls.refreshed_at.asc().nullsfirst(), cls.id)
+                          .limit(limit)]
+
+    @classmethod
+    def revalidate(cls, food_info):
+        """
+        Bring a food & its servings up to date with a Fatsecret food_get
+        result: new foods & servings are inserted, changed rows updated,
+        unchanged rows left alone. Servings Fatsecret dropped are kept,
+        food logs refer to them. A food renamed like another one gets
+        its id in its name, as in upsert. Not committed.
+        Returns the number of inserted & updated rows.
+        """
+
+        food_id = int(food_info['food_id'])
+        food = cls.query.get(food_id)
+
+        if food is None:
+            cls.upsert(food_info)
+            return 1 + len(as_list(food_info['servings']['serving']))
+
+        changed = 0
+        name = food_info['food_name']
+
+        if db.session.query(cls.query.filter(cls.name == name, cls.id != food_id)
+                                     .exists()).scalar():
+            name = f"{name} #{food_id}"
+
+        values = {'name': name,
+                  'brand': food_info.get('brand_name') or "Generic",
+                  'food_url': food_info.get('food_url')}
+
+        if any(getattr(food, key) != value for key, value in values.items()):
+            for key, value in values.items():
+                setattr(food, key, value)
+            changed += 1
+
+        stored = {s.serving_id: s for s in food.food_serving}
+
+        for serving in as_list(food_info['servings']['serving']):
+            row = FoodServing.row(food_id, serving)
+            row = {c.name: FoodServing.coerce(c, row[c.name])
+                   for c in FoodServing.__table__.columns}
+            old = stored.get(row['serving_id'])
+
+            if old is None:
+                db.session.add(FoodServing(**row))
+                changed += 1
+
+            elif any(getattr(old, key) != value for key, value in row.items()):
+                for key, value in row.items():
+                    setattr(old, key, value)
+                changed += 1
+
+        food.refreshed_at = datetime.utcnow()
+
+        return changed
+
+    @classmethod
+    def refresh_popularity(cls):
+        """Recount how many times each food is logged. Not committed."""
+
+        counts = (db.session.query(FoodLog.food_id, db.func.count().label('n'))
+                            .group_by(FoodLog.food_id)
+                            .subquery())
+
+        return db.session.execute(
+            db.update(cls.__table__)
+              .where(cls.id == counts.c.food_id)
+              .where(cls.popularity != counts.c.n)
+              .values(popularity=counts.c.n)
+        ).rowcount
+
+    @classmethod
+    def upsert(cls, food_info):
+        """
+        Register a Fatsecret food & all of its servings.
+        Rows already in the database are skipped (ON CONFLICT DO NOTHING),
+        so two first-time adds of the same food can't collide.
+        A new food named like another one gets its id in its name
+        ("Apples #35719"): food names are unique.
+        Nothing is committed here; the caller commits it together
+        with the food log in one transaction.
+        """
+
+        food_id = int(food_info['food_id'])
+        name = food_info['food_name']
+
+        taken = db.exists().where(db.and_(cls.name == name, cls.id != food_id))
+
+        db.session.execute(
+            insert(cls.__table__)
+            .values(
+                id=food_id,
+                name=db.case((taken, f"{name} #{food_id}"), else_=name),
+                brand=food_info.get('brand_name') or "Generic",
+                food_url=food_info.get('food_url'),
+                refreshed_at=datetime.utcnow()
+            )
+            # NO TARGET: AN id OR A name CONFLICT SKIPS THE ROW
+            .on_conflict_do_nothing()
+        )
+
+        rows = [FoodServing.row(food_id, s)
+                for s in as_list(food_info['servings']['serving'])]
+
+        db.session.execute(
+            insert(FoodServing.__table__)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=['serving_id'])
+        )
+
 
 class FoodServing(db.Model):
     """Food servings information received from Fatsecret API"""
@@ -264,6 +674,239 @@ class FoodServing(db.Model):
 
         return f"FoodServing for Food #{self.food_id} & serving description {self.serving_description} "
 
+    @classmethod
+    def row(cls, food_id, serving):
+        """
+        Fatsecret serving dict => food_servings row.
+        Every column gets a key (multi-row VALUES needs the same keys
+        in each row) and fields we don't store are dropped.
+        """
+
+        row = {c.name: serving.get(c.name) for c in cls.__table__.columns}
+        row['food_id'] = food_id
+
+        return row
+
+    @staticmethod
+    def coerce(column, value):
+        """A Fatsecret (string) value as it is stored in `column`."""
+
+        if value is None:
+            return None
+        if isinstance(column.type, db.Float):
+            return float(value)
+        if isinstance(column.type, db.Integer):
+            return int(value)
+
+        return str(value)
+
+    def to_payload(self):
+        """The serving as a Fatsecret serving dict (all values are strings)."""
+
+        payload = {}
+        for column in self.__table__.columns:
+            value = getattr(self, column.name)
+            if isinstance(value, float):
+                value = f"{value:g}"
+            payload[column.name] = None if value is None else str(value)
+
+        return payload
+
+
+class UserFood(db.Model):
+    """
+    The foods a user has logged, with how often & when.
+    Kept up to date by triggers on food_logs (see USER_FOODS_TRIGGERS),
+    so it is current after every insert, COPY, update or delete of logs.
+    """
+
+    __tablename__ = 'user_foods'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True
+    )
+
+    food_id = db.Column(
+        db.Integer,
+        db.ForeignKey('foods.id', ondelete="cascade"),
+        primary_key=True
+    )
+
+    log_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+
+    last_logged = db.Column(
+        db.Date
+    )
+
+    # SERVING & AMOUNT OF THE LAST INSERTED LOG OF THE FOOD (AS EDITED SINCE)
+    last_serving_id = db.Column(
+        db.Integer
+    )
+
+    last_amount = db.Column(
+        db.Float
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now()
+    )
+
+    food = db.relationship('Food')
+
+    def __repr__(self):
+
+        return f"<UserFood user #{self.user_id} food #{self.food_id} x{self.log_count}>"
+
+    @classmethod
+    def search(cls, user_id, term, page_number=0, max_results=20):
+        """
+        Search the foods the user has logged, by name or brand substring.
+        Name prefix matches come first, then the user's favorites:
+        the more often & the more recently logged, the higher.
+        Returns (results, last_page) shaped like Fatsecret search results.
+        """
+
+        term = term.strip()
+        if not term:
+            return [], True
+
+        escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        days_ago = db.func.current_date() - cls.last_logged
+        score = cls.log_count / (1.0 + days_ago / 30.0)
+
+        rows = (db.session.query(Food, cls)
+                          .join(cls, cls.food_id == Food.id)
+                          .filter(cls.user_id == user_id,
+                                  cls.log_count > 0,
+                                  db.or_(Food.name.ilike(f"%{escaped}%", escape='\\'),
+                                         Food.brand.ilike(f"%{escaped}%", escape='\\')))
+                          .order_by(Food.name.ilike(f"{escaped}%", escape='\\').desc(),
+                                    score.desc(),
+                                    Food.name)
+                          .offset(page_number * max_results)
+                          .limit(max_results + 1)
+                          .all())
+
+        last_page = len(rows) <= max_results
+        rows = rows[:max_results]
+
+        servings = {s.serving_id: s for s in FoodServing.query.filter(
+            FoodServing.serving_id.in_([uf.last_serving_id for _, uf in rows]))}
+
+        return [food.to_search_result(servings.get(uf.last_serving_id))
+                for food, uf in rows], last_page
+
+    @classmethod
+    def stamp(cls, user_id):
+        """(count, last change) of the user's foods: changes whenever they do."""
+
+        return tuple(db.session.query(db.func.count(), db.func.max(cls.updated_at))
+                                .filter(cls.user_id == user_id)
+                                .one())
+
+    @classmethod
+    def rebuild(cls):
+        """Recount user_foods from food_logs (e.g. for old logs). Not committed."""
+
+        db.session.execute(text("DELETE FROM user_foods"))
+        db.session.execute(text(
+            "INSERT INTO user_foods (user_id, food_id, log_count, last_logged, "
+            "                        last_serving_id, last_amount, updated_at) "
+            "SELECT user_id, food_id, count(*), max(date), "
+            "       (array_agg(serving_id ORDER BY id DESC))[1], "
+            "       (array_agg(amount ORDER BY id DESC))[1], now() "
+            "FROM food_logs GROUP BY user_id, food_id"
+        ))
+
+
+class DailyTotal(db.Model):
+    """
+    A user's calories & number of logs of a day.
+    Kept up to date by triggers on food_logs (see DAILY_TOTALS_TRIGGERS);
+    `version` goes up on every change of the day's logs, so it can stamp
+    cached pages of the day.
+    """
+
+    __tablename__ = 'daily_totals'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True
+    )
+
+    date = db.Column(
+        db.Date,
+        primary_key=True
+    )
+
+    calories = db.Column(
+        db.Float,
+        nullable=False,
+        default=0
+    )
+
+    entries = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now()
+    )
+
+    def __repr__(self):
+
+        return f"<DailyTotal user #{self.user_id} {self.date}: {self.calories} kcal>"
+
+    @classmethod
+    def for_range(cls, user_id, first, last):
+        """The user's totals of the days from `first` to `last`, by date
+        (days without any logs are missing)."""
+
+        return {total.date: total for total in cls.query.filter(
+            cls.user_id == user_id,
+            cls.date.between(first, last)
+        )}
+
+    @classmethod
+    def stamp(cls, user_id, the_date):
+        """(version, last change) of the user's day, None before its first log:
+        changes whenever a log of the day does."""
+
+        return (db.session.query(cls.version, cls.updated_at)
+                          .filter(cls.user_id == user_id,
+                                  cls.date == the_date)
+                          .first())
+
+    @classmethod
+    def rebuild(cls):
+        """Recount daily_totals from food_logs (e.g. for old logs). Not committed."""
+
+        db.session.execute(text("DELETE FROM daily_totals"))
+        db.session.execute(text(
+            "INSERT INTO daily_totals (user_id, date, calories, entries, version, updated_at) "
+            "SELECT user_id, date, sum(calories), count(*), 1, now() "
+            "FROM food_logs GROUP BY user_id, date"
+        ))
+
 
 class User(db.Model):
     """User credentials."""
@@ -348,6 +991,472 @@ class User(db.Model):
         return False
     
 
+class Job(db.Model):
+    """
+    A unit of background work, run by `flask worker` (see jobs.py).
+    Workers claim queued jobs with SELECT ... FOR UPDATE SKIP LOCKED and
+    hold them until `locked_until`; a job whose worker died becomes
+    claimable again after that visibility timeout.
+    """
+
+    __tablename__ = 'jobs'
+
+    __table_args__ = (
+        # ONE QUEUED / RUNNING JOB PER KEY (e.g. ingest_food:1234)
+        db.Index('ix_jobs_active_key', 'key', unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')")),
+        db.Index('ix_jobs_claim', 'status', 'run_at'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=True
+    )
+
+    kind = db.Column(
+        db.String(50),
+        nullable=False
+    )
+
+    key = db.Column(
+        db.String
+    )
+
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict
+    )
+
+    # queued => running => done / failed (or back to queued for a retry)
+    status = db.Column(
+        db.String(10),
+        nullable=False,
+        default='queued'
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now()
+    )
+
+    locked_until = db.Column(
+        db.DateTime
+    )
+
+    last_error = db.Column(
+        db.Text
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now()
+    )
+
+    finished_at = db.Column(
+        db.DateTime
+    )
+
+    def __repr__(self):
+
+        return f"<Job #{self.id} {self.kind} {self.status} ({self.attempts}/{self.max_attempts})>"
+
+    @classmethod
+    def enqueue(cls, kind, payload=None, key=None, delay=0, max_attempts=5):
+        """
+        Queue a job, unless a job with the same `key` is already queued or
+        running. Not committed (the job is queued with the caller's work).
+        """
+
+        db.session.execute(
+            insert(cls.__table__)
+              .values(kind=kind,
+                      key=key,
+                      payload=payload or {},
+                      status='queued',
+                      attempts=0,
+                      max_attempts=max_attempts,
+                      run_at=db.func.now() + timedelta(seconds=delay))
+              .on_conflict_do_nothing(
+                  index_elements=['key'],
+                  index_where=db.text("status IN ('queued', 'running')"))
+        )
+
+    @classmethod
+    def claim(cls, timeout):
+        """
+        Take the next due job (or a running one whose lock expired) for
+        `timeout` seconds and commit, or return None.
+        Concurrent workers skip each other's locked rows.
+        """
+
+        now = db.func.now()
+
+        job = (cls.query
+                  .filter(db.or_(db.and_(cls.status == 'queued', cls.run_at <= now),
+                                 db.and_(cls.status == 'running', cls.locked_until < now)))
+                  .order_by(cls.run_at, cls.id)
+                  .with_for_update(skip_locked=True)
+                  .first())
+
+        if job is None:
+            db.session.rollback()
+            return None
+
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_until = now + timedelta(seconds=timeout)
+        db.session.commit()
+
+        return job
+
+    def finish(self):
+        """Mark the job as done. Not committed."""
+
+        self.status = 'done'
+        self.locked_until = None
+        self.last_error = None
+        self.finished_at = db.func.now()
+
+    def fail(self, error, backoff):
+        """
+        Queue the job again in `backoff` * 2 ** (attempts - 1) seconds,
+        or mark it as failed after its last attempt. Not committed.
+        """
+
+        self.last_error = error
+        self.locked_until = None
+
+        if self.attempts >= self.max_attempts:
+            self.status = 'failed'
+            self.finished_at = db.func.now()
+        else:
+            self.status = 'queued'
+            self.run_at = db.func.now() + timedelta(seconds=backoff * 2 ** (self.attempts - 1))
+
+
+###########################################################
+# LOCAL FOOD SEARCH:
+
+SEARCH_CONFIG = db.literal_column("'simple'::regconfig")
+
+
+@event.listens_for(Food.__table__, 'before_create')
+def create_search_extension(target, connection, **kw):
+    """Trigram similarity (the % operator) comes from pg_trgm."""
+
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+
+@event.listens_for(Food.__table__, 'after_create')
+def create_search_indexes(target, connection, **kw):
+    """Full text & trigram indexes of the local food search."""
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_foods_search ON foods "
+        "USING gin (to_tsvector('simple'::regconfig, name || ' ' || brand))"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_foods_name_trgm ON foods "
+        "USING gin (name gin_trgm_ops)"
+    ))
+
+
+###########################################################
+# FOOD LOG PARTITIONS:
+
+# HOW MANY MONTHS OF EMPTY PARTITIONS ARE KEPT READY AHEAD OF TODAY
+PARTITION_MONTHS_AHEAD = 3
+
+
+def month_start(day):
+    """First day of the month of `day`."""
+
+    return day.replace(day=1)
+
+
+def add_months(day, months):
+    """First day of the month `months` after the month of `day`."""
+
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_ranges(first, last):
+    """(name, lower, upper) of the monthly food_logs partitions from the
+    month of `first` to the month of `last`; upper is exclusive."""
+
+    month = month_start(first)
+    last = month_start(last)
+
+    while month <= last:
+        upper = add_months(month, 1)
+        yield f"food_logs_{month:%Y_%m}", month, upper
+        month = upper
+
+
+def ensure_food_log_partitions(connection, first=None, last=None, dates=None):
+    """
+    Create the monthly partitions of food_logs from `first` to `last`
+    (default: this month & PARTITION_MONTHS_AHEAD months ahead), or
+    only those of the months of `dates`, without the months between.
+    Rows of those months waiting in the default partition are moved in.
+    Returns the names of the created partitions.
+    Does nothing if food_logs is not a partitioned table (old databases).
+    """
+
+    is_partitioned = connection.execute(text(
+        "SELECT relkind = 'p' FROM pg_class "
+        "WHERE oid = to_regclass('food_logs')"
+    )).scalar()
+
+    if not is_partitioned:
+        return []
+
+    # ONLY ONE WORKER AT A TIME MAY CREATE PARTITIONS
+    connection.execute(text(
+        "SELECT pg_advisory_xact_lock(hashtext('food_logs_partitions'))"
+    ))
+
+    existing = {name for (name,) in connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'food_logs'::regclass"
+    ))}
+
+    today = date.today()
+
+    if dates is not None:
+        ranges = [partition for month in sorted({month_start(day) for day in dates})
+                  for partition in partition_ranges(month, month)]
+    else:
+        ranges = partition_ranges(first or today,
+                                  last or add_months(today, PARTITION_MONTHS_AHEAD))
+
+    created = []
+    for name, month, upper in ranges:
+        if name not in existing:
+            connection.execute(text(
+                f"CREATE TABLE {name} "
+                f"(LIKE food_logs INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            ))
+
+            if 'food_logs_default' in existing:
+                connection.execute(text(
+                    f"WITH moved AS ("
+                    f"  DELETE FROM food_logs_default "
+                    f"  WHERE date >= :lower AND date < :upper "
+                    f"  RETURNING *) "
+                    f"INSERT INTO {name} SELECT * FROM moved"
+                ), {"lower": month, "upper": upper})
+
+            connection.execute(text(
+                f"ALTER TABLE food_logs ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{month}') TO ('{upper}')"
+            ))
+            created.append(name)
+
+    return created
+
+
+###########################################################
+# FOOD LOG TRIGGERS:
+
+# AFTER A DELETE OR UPDATE, THE TOUCHED (user_id, food_id) PAIRS ARE RECOUNTED
+# FROM food_logs: THE LAST LOG MAY BE GONE OR CHANGED. PAIRS WITHOUT LOGS ARE
+# DROPPED; ONLY EXISTING LOGS ARE INSERTED, SO THE LOGS OF A DELETED USER OR
+# FOOD CAN'T BRING BACK ITS user_foods ROWS
+USER_FOODS_RECOUNT = """
+    INSERT INTO user_foods AS uf (user_id, food_id, log_count, last_logged,
+                                  last_serving_id, last_amount, updated_at)
+    SELECT fl.user_id, fl.food_id, count(*), max(fl.date),
+           (array_agg(fl.serving_id ORDER BY fl.id DESC))[1],
+           (array_agg(fl.amount ORDER BY fl.id DESC))[1], now()
+    FROM food_logs AS fl
+    JOIN (SELECT DISTINCT user_id, food_id FROM ({pairs}) AS p) AS pairs
+      ON fl.user_id = pairs.user_id AND fl.food_id = pairs.food_id
+    GROUP BY fl.user_id, fl.food_id
+    ON CONFLICT (user_id, food_id) DO UPDATE SET
+        log_count = EXCLUDED.log_count,
+        last_logged = EXCLUDED.last_logged,
+        last_serving_id = EXCLUDED.last_serving_id,
+        last_amount = EXCLUDED.last_amount,
+        updated_at = now();
+
+    DELETE FROM user_foods AS uf
+    USING (SELECT DISTINCT user_id, food_id FROM ({pairs}) AS p) AS pairs
+    WHERE uf.user_id = pairs.user_id AND uf.food_id = pairs.food_id
+      AND NOT EXISTS (SELECT 1 FROM food_logs AS fl
+                      WHERE fl.user_id = uf.user_id AND fl.food_id = uf.food_id);
+"""
+
+# STATEMENT LEVEL TRIGGERS SEE ALL ROWS OF AN INSERT / COPY / DELETE AT ONCE
+# (FROM ALL PARTITIONS), SO A BULK LOAD COSTS ONE UPSERT PER STATEMENT
+USER_FOODS_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION user_foods_logged() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO user_foods AS uf (user_id, food_id, log_count, last_logged,
+                                  last_serving_id, last_amount, updated_at)
+    SELECT user_id, food_id, count(*), max(date),
+           (array_agg(serving_id ORDER BY id DESC))[1],
+           (array_agg(amount ORDER BY id DESC))[1], now()
+    FROM new_logs
+    GROUP BY user_id, food_id
+    ON CONFLICT (user_id, food_id) DO UPDATE SET
+        log_count = uf.log_count + EXCLUDED.log_count,
+        last_logged = greatest(uf.last_logged, EXCLUDED.last_logged),
+        last_serving_id = EXCLUDED.last_serving_id,
+        last_amount = EXCLUDED.last_amount,
+        updated_at = now();
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_foods_unlogged() RETURNS trigger AS $$
+BEGIN
+    {USER_FOODS_RECOUNT.format(pairs="SELECT user_id, food_id FROM old_logs")}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION user_foods_relogged() RETURNS trigger AS $$
+BEGIN
+    {USER_FOODS_RECOUNT.format(pairs="SELECT user_id, food_id FROM old_logs "
+                                     "UNION ALL SELECT user_id, food_id FROM new_logs")}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS food_logs_user_foods_insert ON food_logs;
+CREATE TRIGGER food_logs_user_foods_insert
+    AFTER INSERT ON food_logs
+    REFERENCING NEW TABLE AS new_logs
+    FOR EACH STATEMENT EXECUTE PROCEDURE user_foods_logged();
+
+DROP TRIGGER IF EXISTS food_logs_user_foods_delete ON food_logs;
+CREATE TRIGGER food_logs_user_foods_delete
+    AFTER DELETE ON food_logs
+    REFERENCING OLD TABLE AS old_logs
+    FOR EACH STATEMENT EXECUTE PROCEDURE user_foods_unlogged();
+
+DROP TRIGGER IF EXISTS food_logs_user_foods_update ON food_logs;
+CREATE TRIGGER food_logs_user_foods_update
+    AFTER UPDATE ON food_logs
+    REFERENCING OLD TABLE AS old_logs NEW TABLE AS new_logs
+    FOR EACH STATEMENT EXECUTE PROCEDURE user_foods_relogged();
+"""
+
+
+# A DAY'S CALORIES & ENTRIES MOVE BY THE SUM OF THE ADDED LOGS; AN UPDATE
+# COUNTS AS REMOVING THE OLD ROWS & ADDING THE NEW ONES. DELETES ONLY UPDATE,
+# SO THE LOGS OF A DELETED USER CAN'T BRING BACK ITS daily_totals ROWS
+DAILY_TOTALS_UPSERT = """
+    INSERT INTO daily_totals AS dt (user_id, date, calories, entries, version, updated_at)
+    SELECT user_id, date, sum(calories), sum(entries), 1, now()
+    FROM ({changes}) AS changes
+    GROUP BY user_id, date
+    ON CONFLICT (user_id, date) DO UPDATE SET
+        calories = CASE WHEN dt.entries + EXCLUDED.entries > 0
+                        THEN dt.calories + EXCLUDED.calories ELSE 0 END,
+        entries = dt.entries + EXCLUDED.entries,
+        version = dt.version + 1,
+        updated_at = now();
+"""
+
+ADDED_LOGS = "SELECT user_id, date, calories, 1 AS entries FROM new_logs"
+REMOVED_LOGS = "SELECT user_id, date, -calories, -1 FROM old_logs"
+
+DAILY_TOTALS_TRIGGERS = f"""
+CREATE OR REPLACE FUNCTION daily_totals_logged() RETURNS trigger AS $$
+BEGIN
+    {DAILY_TOTALS_UPSERT.format(changes=ADDED_LOGS)}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION daily_totals_relogged() RETURNS trigger AS $$
+BEGIN
+    {DAILY_TOTALS_UPSERT.format(changes=ADDED_LOGS + " UNION ALL " + REMOVED_LOGS)}
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION daily_totals_unlogged() RETURNS trigger AS $$
+BEGIN
+    UPDATE daily_totals AS dt
+    SET calories = CASE WHEN dt.entries > gone.n THEN dt.calories - gone.calories ELSE 0 END,
+        entries = greatest(dt.entries - gone.n, 0),
+        version = dt.version + 1,
+        updated_at = now()
+    FROM (SELECT user_id, date, sum(calories) AS calories, count(*) AS n
+          FROM old_logs GROUP BY user_id, date) AS gone
+    WHERE dt.user_id = gone.user_id AND dt.date = gone.date;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS food_logs_daily_totals_insert ON food_logs;
+CREATE TRIGGER food_logs_daily_totals_insert
+    AFTER INSERT ON food_logs
+    REFERENCING NEW TABLE AS new_logs
+    FOR EACH STATEMENT EXECUTE PROCEDURE daily_totals_logged();
+
+DROP TRIGGER IF EXISTS food_logs_daily_totals_delete ON food_logs;
+CREATE TRIGGER food_logs_daily_totals_delete
+    AFTER DELETE ON food_logs
+    REFERENCING OLD TABLE AS old_logs
+    FOR EACH STATEMENT EXECUTE PROCEDURE daily_totals_unlogged();
+
+DROP TRIGGER IF EXISTS food_logs_daily_totals_update ON food_logs;
+CREATE TRIGGER food_logs_daily_totals_update
+    AFTER UPDATE ON food_logs
+    REFERENCING OLD TABLE AS old_logs NEW TABLE AS new_logs
+    FOR EACH STATEMENT EXECUTE PROCEDURE daily_totals_relogged();
+"""
+
+
+@event.listens_for(FoodLog.__table__, 'after_create')
+def create_food_log_triggers(target, connection, **kw):
+    """Summary tables of food_logs are kept up to date by triggers."""
+
+    connection.execute(text(USER_FOODS_TRIGGERS))
+    connection.execute(text(DAILY_TOTALS_TRIGGERS))
+
+
+@event.listens_for(FoodLog.__table__, 'after_create')
+def create_food_log_partitions(target, connection, **kw):
+    """New food_logs table gets its default & first monthly partitions."""
+
+    connection.execute(text(
+        "CREATE TABLE food_logs_default PARTITION OF food_logs DEFAULT"
+    ))
+    ensure_food_log_partitions(connection)
+
+
+###########################################################
+# HELPERS:
+
+def as_list(servings):
+    """Fatsecret sends one serving as a dict & many as a list."""
+
+    return servings if isinstance(servings, list) else [servings]
+
+
 ###########################################################
 # DATABASE CONNECTION:
 
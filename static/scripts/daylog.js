@@ -0,0 +1,261 @@
+// DAY LOG: ADD, EDIT & DELETE FOOD LOGS THROUGH THE JSON API (/api/v1)
+// AND PATCH THE PAGE IN PLACE, NO PAGE RELOADS.
+// CHANGES ON THE HOME PAGE ARE SHOWN AT ONCE (OPTIMISTIC) AND ROLLED
+// BACK IF THE SERVER REFUSES THEM. WITHOUT JAVASCRIPT THE FORMS STILL
+// POST AS BEFORE.
+
+const DayLog = (function () {
+  const API = "/api/v1";
+
+  // FETCH JSON; THROWS AN Error WITH THE SERVER'S MESSAGE
+  async function api(method, path, body) {
+    const response = await fetch(API + path, {
+      method: method,
+      credentials: "same-origin",
+      headers: body ? { "Content-Type": "application/json" } : {},
+      body: body ? JSON.stringify(body) : undefined,
+    });
+
+    let data = {};
+    try {
+      data = await response.json();
+    } catch (e) {
+      // NOT JSON (e.g. A PROXY ERROR PAGE)
+    }
+
+    if (!response.ok) {
+      throw new Error(data.error || `Request failed (${response.status})`);
+    }
+    return data;
+  }
+
+  // A DISMISSABLE MESSAGE WHERE THE FLASH MESSAGES ARE
+  function flash(message, category) {
+    const div = document.createElement("div");
+    div.className = `alert alert-${category || "danger"}`;
+    div.textContent = message;
+    div.addEventListener("click", () => div.remove());
+
+    const nav = document.querySelector("#main-div nav");
+    if (nav) {
+      nav.after(div);
+    } else {
+      document.body.prepend(div);
+    }
+  }
+
+  // TELL OTHER SCRIPTS (daynav.js) THAT THE SHOWN DAY CHANGED
+  function changed() {
+    document.dispatchEvent(new CustomEvent("daylog:changed"));
+  }
+
+  ///////////////////////////////////////////////////////////
+  // TOTALS
+
+  function totalSpan(key) {
+    return document.querySelector(`[data-total="${key}"]`);
+  }
+
+  function renderTotals(totals) {
+    for (const key of ["calories", "left_for_limit", "left_for_need"]) {
+      const span = totalSpan(key);
+      if (span) {
+        span.textContent = totals[key];
+      }
+    }
+  }
+
+  // MOVE THE CONSUMED CALORIES BY delta & RECOMPUTE WHAT IS LEFT
+  function shiftTotals(delta) {
+    const table = document.getElementById("day-log");
+    const consumed = totalSpan("calories");
+    if (!table || !consumed) {
+      return;
+    }
+
+    const calories = parseInt(consumed.textContent, 10) + delta;
+    renderTotals({
+      calories: calories,
+      left_for_limit: parseInt(table.dataset.calorieLimit, 10) - calories,
+      left_for_need: parseInt(table.dataset.calorieNeed, 10) - calories,
+    });
+  }
+
+  ///////////////////////////////////////////////////////////
+  // ROWS OF THE HOME PAGE TABLE
+
+  function cell(row, field) {
+    return row.querySelector(`[data-field="${field}"]`);
+  }
+
+  function rowCalories(row, amount) {
+    return Math.round(
+      (amount * parseFloat(row.dataset.unitCalories)) /
+        parseFloat(row.dataset.numberOfUnits)
+    );
+  }
+
+  // ROW NUMBERS & THE "NOTHING EATEN" MESSAGE AFTER ROWS COME & GO
+  function refreshRows() {
+    const table = document.getElementById("day-log");
+    if (!table) {
+      return;
+    }
+
+    const rows = table.querySelectorAll("tr[data-log-id]");
+    rows.forEach((row, index) => {
+      cell(row, "index").textContent = index + 1;
+    });
+
+    table.classList.toggle("d-none", rows.length === 0);
+    document
+      .getElementById("nothing-eaten")
+      .classList.toggle("d-none", rows.length > 0);
+  }
+
+  async function deleteLog(row) {
+    const parent = row.parentNode;
+    const next = row.nextSibling;
+    const calories = parseInt(cell(row, "calories").textContent, 10);
+
+    row.remove();
+    shiftTotals(-calories);
+    refreshRows();
+
+    try {
+      const data = await api("DELETE", `/logs/${row.dataset.logId}`);
+      renderTotals(data.day.totals);
+      changed();
+    } catch (error) {
+      parent.insertBefore(row, next);
+      shiftTotals(calories);
+      refreshRows();
+      flash(`The food log could not be deleted: ${error.message}`);
+    }
+  }
+
+  async function changeAmount(input) {
+    const row = input.closest("tr[data-log-id]");
+    const calorieCell = cell(row, "calories");
+    const oldAmount = input.defaultValue;
+    const oldCalories = parseInt(calorieCell.textContent, 10);
+    const amount = parseFloat(input.value);
+
+    if (!(amount > 0)) {
+      input.value = oldAmount;
+      return;
+    }
+
+    const calories = rowCalories(row, amount);
+    calorieCell.textContent = calories;
+    shiftTotals(calories - oldCalories);
+
+    try {
+      const data = await api("PATCH", `/logs/${row.dataset.logId}`, {
+        amount: amount,
+      });
+      input.defaultValue = input.value;
+      calorieCell.textContent = Math.round(data.log.calories);
+      renderTotals(data.day.totals);
+      changed();
+    } catch (error) {
+      input.value = oldAmount;
+      calorieCell.textContent = oldCalories;
+      shiftTotals(oldCalories - calories);
+      flash(`The amount could not be changed: ${error.message}`);
+    }
+  }
+
+  ///////////////////////////////////////////////////////////
+  // ADD & EDIT PAGES
+
+  function status(message, category) {
+    const box = document.getElementById("log-status");
+    box.className = `mt-3 alert alert-${category}`;
+    box.textContent = message;
+  }
+
+  function dayMessage(totals) {
+    return (
+      `${totals.calories} kcal eaten this day, ` +
+      `${totals.left_for_limit} left for the limit.`
+    );
+  }
+
+  async function addLog(form, button) {
+    // THE SERVING SELECT HOLDS "(food_id, serving_id)"
+    const [foodId, servingId] = form.elements.servings.value.match(/\d+/g);
+
+    button.disabled = true;
+    status("Logging...", "secondary");
+
+    try {
+      const data = await api("POST", "/logs", {
+        food_id: foodId,
+        serving_id: servingId,
+        amount: parseFloat(form.elements.amount.value),
+        date: form.dataset.date,
+      });
+      status(
+        `${data.log.food_name} logged (${Math.round(data.log.calories)} kcal). ` +
+          dayMessage(data.day.totals),
+        "success"
+      );
+      form.elements.amount.value = "";
+    } catch (error) {
+      status(`The food could not be logged: ${error.message}`, "danger");
+    } finally {
+      button.disabled = false;
+    }
+  }
+
+  async function editLog(form) {
+    try {
+      const data = await api("PATCH", `/logs/${form.dataset.logId}`, {
+        amount: parseFloat(form.elements.amount.value),
+      });
+      status(
+        `Changed to ${data.log.amount} (${Math.round(data.log.calories)} kcal). ` +
+          dayMessage(data.day.totals),
+        "success"
+      );
+    } catch (error) {
+      status(`The food log could not be changed: ${error.message}`, "danger");
+    }
+  }
+
+  ///////////////////////////////////////////////////////////
+  // LISTENERS
+
+  document.addEventListener("click", (event) => {
+    const button = event.target.closest('#day-log [data-action="delete"]');
+    if (button) {
+      event.preventDefault();
+      deleteLog(button.closest("tr[data-log-id]"));
+    }
+  });
+
+  document.addEventListener("change", (event) => {
+    if (event.target.matches('#day-log [data-field="amount"]')) {
+      changeAmount(event.target);
+    }
+  });
+
+  document.addEventListener("submit", (event) => {
+    const form = event.target;
+
+    // "ADD TO CART" STILL POSTS THE FORM
+    if (form.id === "add-food-form") {
+      const button = event.submitter;
+      if (button && button.dataset.action === "add") {
+        event.preventDefault();
+        addLog(form, button);
+      }
+    } else if (form.id === "edit-food-form") {
+      event.preventDefault();
+      editLog(form);
+    }
+  });
+
+  return { api, flash, renderTotals, refreshRows };
+})();
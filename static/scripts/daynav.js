@@ -0,0 +1,169 @@
+// DAY NAVIGATION: THE ARROWS OF THE HOME PAGE SHOW OTHER DAYS FROM
+// /api/v1/days/<date> WITHOUT RELOADING THE PAGE. THE DAYS BEFORE &
+// AFTER THE SHOWN ONE ARE FETCHED AHEAD, SO FLIPPING THROUGH DAYS IS
+// INSTANT. THE URL BECOMES /day/<date>, WHICH THE SERVER ALSO RENDERS.
+
+(function () {
+  const table = document.getElementById("day-log");
+  if (!table || !window.fetch || !window.history.pushState) {
+    return;
+  }
+
+  const MONTHS = [
+    "January", "February", "March", "April", "May", "June", "July",
+    "August", "September", "October", "November", "December",
+  ];
+  const WEEKDAYS = [
+    "Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday",
+    "Saturday",
+  ];
+
+  // DAYS JSON BY DATE (PROMISES, SO A PREFETCH IN FLIGHT IS SHARED)
+  const days = new Map();
+
+  // DATES ARE YYYY-MM-DD STRINGS; UTC KEEPS THE ARITHMETIC OFF DST
+  function addDays(isoDate, count) {
+    const day = new Date(`${isoDate}T00:00:00Z`);
+    day.setUTCDate(day.getUTCDate() + count);
+    return day.toISOString().slice(0, 10);
+  }
+
+  function suffix(day) {
+    if ([1, 21, 31].includes(day)) return "st";
+    if ([2, 22].includes(day)) return "nd";
+    if ([3, 23].includes(day)) return "rd";
+    return "th";
+  }
+
+  function fetchDay(isoDate) {
+    if (!days.has(isoDate)) {
+      const request = DayLog.api("GET", `/days/${isoDate}`);
+      // A FAILED FETCH IS TRIED AGAIN NEXT TIME
+      request.catch(() => days.delete(isoDate));
+      days.set(isoDate, request);
+    }
+    return days.get(isoDate);
+  }
+
+  function prefetch(isoDate) {
+    for (const count of [-1, 1]) {
+      fetchDay(addDays(isoDate, count)).catch(() => {});
+    }
+  }
+
+  ///////////////////////////////////////////////////////////
+  // RENDERING
+
+  function setField(row, field, value) {
+    row.querySelector(`[data-field="${field}"]`).textContent = value;
+  }
+
+  function logRow(log, index) {
+    const row = document
+      .getElementById("log-row")
+      .content.querySelector("tr")
+      .cloneNode(true);
+
+    row.dataset.logId = log.id;
+    row.dataset.unitCalories = log.unit_calories;
+    row.dataset.numberOfUnits = log.number_of_units;
+
+    row.querySelector('[name="log_ids"]').value = log.id;
+    setField(row, "index", index + 1);
+    setField(row, "food_name", log.food_name);
+    setField(row, "brand_name", log.brand_name);
+    setField(
+      row,
+      "serving_description",
+      log.serving_description === "100 g" ? "grams" : log.serving_description
+    );
+    setField(row, "calories", Math.round(log.calories));
+
+    const amount = row.querySelector('[data-field="amount"]');
+    amount.name = `amount-${log.id}`;
+    amount.value = amount.defaultValue = log.amount;
+
+    row.querySelector('[data-action="edit"]').setAttribute("formaction", `/food/edit/${log.id}`);
+    row.querySelector('[data-action="delete"]').setAttribute("formaction", `/food/delete/${log.id}`);
+
+    return row;
+  }
+
+  function render(day) {
+    const [year, month, date] = day.date.split("-").map(Number);
+    const weekday = new Date(Date.UTC(year, month - 1, date)).getUTCDay();
+
+    const title = document.getElementById("day-title");
+    title.innerHTML = "";
+    title.append(`${MONTHS[month - 1]} ${date}`);
+    const sup = document.createElement("sup");
+    sup.textContent = suffix(date);
+    title.append(sup, ` ${year} / ${WEEKDAYS[weekday]}`);
+
+    const tbody = table.querySelector("tbody");
+    tbody.replaceChildren(...day.logs.map(logRow));
+
+    table.dataset.date = day.date;
+    DayLog.renderTotals(day.totals);
+    DayLog.refreshRows();
+
+    document.querySelector('#day-form [name="from_date"]').value = day.date;
+    document.querySelectorAll(".day-nav [data-days]").forEach((link) => {
+      link.href = `/day/${addDays(day.date, parseInt(link.dataset.days, 10))}`;
+    });
+  }
+
+  async function show(isoDate, push) {
+    let day;
+    try {
+      day = await fetchDay(isoDate);
+    } catch (error) {
+      // FALL BACK TO THE SERVER RENDERED PAGE
+      window.location = `/day/${isoDate}`;
+      return;
+    }
+
+    render(day);
+    if (push) {
+      history.pushState({ date: isoDate }, "", `/day/${isoDate}`);
+    }
+
+    // FOODS ADDED FROM NOW ON GO TO THIS DAY
+    DayLog.api("PUT", "/date", { date: isoDate }).catch(() => {});
+
+    prefetch(isoDate);
+  }
+
+  ///////////////////////////////////////////////////////////
+  // LISTENERS
+
+  document.querySelector(".day-nav").addEventListener("click", (event) => {
+    const link = event.target.closest("a");
+    if (!link) {
+      return;
+    }
+
+    const target = link.dataset.days
+      ? addDays(table.dataset.date, parseInt(link.dataset.days, 10))
+      : link.dataset.today;
+
+    if (target) {
+      event.preventDefault();
+      show(target, true);
+    }
+  });
+
+  window.addEventListener("popstate", (event) => {
+    if (event.state && event.state.date) {
+      show(event.state.date, false);
+    }
+  });
+
+  // A CHANGED DAY IS FETCHED AGAIN WHEN IT IS SHOWN NEXT TIME
+  document.addEventListener("daylog:changed", () => {
+    days.delete(table.dataset.date);
+  });
+
+  history.replaceState({ date: table.dataset.date }, "", window.location.href);
+  prefetch(table.dataset.date);
+})();
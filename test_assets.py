@@ -0,0 +1,180 @@
+"""Static asset pipeline tests"""
+
+# run like:
+#
+#   python -m unittest -v test_assets.py
+
+import brotli
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask, render_template_string
+
+import assets
+
+BUNDLES = {
+    'app.css': ('stylesheets/style.css',),
+    'app.js': ('scripts/app.js', 'scripts/daylog.js'),
+}
+
+BACKGROUND = 'images/background1.jpg'
+
+
+class AssetsTestCase(TestCase):
+    """Test the build & the serving of the static assets"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Build our own CSS, JS & small backgrounds into a temporary dist/"""
+
+        cls.dist = tempfile.mkdtemp()
+        manifest = os.path.join(cls.dist, 'manifest.json')
+
+        cls.patches = [patch.object(assets, 'DIST_DIR', cls.dist),
+                       patch.object(assets, 'MANIFEST', manifest),
+                       patch.object(assets, 'BUNDLES', BUNDLES),
+                       patch.object(assets, 'RESPONSIVE_WIDTHS', (64, 128))]
+        for started in cls.patches:
+            started.start()
+
+        cls.manifest = assets.build()
+
+        cls.app = Flask(__name__, static_folder=assets.STATIC_DIR)
+        assets.init_app(cls.app)
+        cls.client = cls.app.test_client()
+
+    @classmethod
+    def tearDownClass(cls):
+
+        for started in cls.patches:
+            started.stop()
+
+        shutil.rmtree(cls.dist, ignore_errors=True)
+
+    def test_build_manifest(self):
+        """Are the bundles & images fingerprinted & listed in the manifest?"""
+
+        files = self.manifest['files']
+
+        self.assertRegex(files['app.css'], r"^app\.[0-9a-f]{8}\.css$")
+        self.assertRegex(files['app.js'], r"^app\.[0-9a-f]{8}\.js$")
+
+        with open(os.path.join(self.dist, 'manifest.json')) as file:
+            self.assertEqual(json.load(file)['files'], files)
+
+        with open(os.path.join(self.dist, files['app.js']), encoding='utf-8') as file:
+            bundle = file.read()
+
+        with open(os.path.join(assets.STATIC_DIR, 'scripts/daylog.js'), encoding='utf-8') as file:
+            self.assertIn(file.read(), bundle)
+
+        jpg = self.manifest['srcsets'][BACKGROUND]['jpg']
+
+        self.assertEqual([width for width, _ in jpg], [64, 128])
+        self.assertTrue(os.path.exists(os.path.join(self.dist, jpg[-1][1])))
+
+    def test_build_compressed(self):
+        """Are the .br & .gz variants the built file compressed?"""
+
+        built = os.path.join(self.dist, self.manifest['files']['app.js'])
+
+        with open(built, 'rb') as file:
+            content = file.read()
+
+        with open(built + '.br', 'rb') as file:
+            self.assertEqual(brotli.decompress(file.read()), content)
+
+        with open(built + '.gz', 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+
+    def test_serve_encodings(self):
+        """Is the best precompressed variant the browser accepts served?"""
+
+        url = f"/assets/{self.manifest['files']['app.js']}"
+
+        with open(os.path.join(self.dist, self.manifest['files']['app.js']), 'rb') as file:
+            content = file.read()
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(resp.get_data()), content)
+        resp.close()
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.get_data()), content)
+        resp.close()
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(), content)
+        self.assertTrue(resp.mimetype.endswith('javascript'))
+        resp.close()
+
+    def test_serve_cache_headers(self):
+        """Are built files cached for a year & unknown ones not served?"""
+
+        resp = self.client.get(f"/assets/{self.manifest['files']['app.css']}",
+                               headers={'Accept-Encoding': 'br'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.cache_control.max_age, assets.CACHE_SECONDS)
+        self.assertTrue(resp.cache_control.public)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        resp.close()
+
+        self.assertEqual(self.client.get("/assets/manifest.json").status_code, 404)
+        self.assertEqual(self.client.get("/assets/app.00000000.css").status_code, 404)
+
+    def test_template_urls(self):
+        """Do the templates get the built URLs, the resized image as fallback?"""
+
+        with self.app.test_request_context():
+            html = render_template_string(
+                "{{ asset_url('app.css') }}|{{ asset_image(image) }}|{{ asset_srcset(image, 'jpg') }}",
+                image=BACKGROUND)
+
+        css, fallback, srcset = html.split('|')
+        small, large = self.manifest['srcsets'][BACKGROUND]['jpg']
+
+        self.assertEqual(css, f"/assets/{self.manifest['files']['app.css']}")
+        self.assertEqual(fallback, f"/assets/{large[1]}")
+        self.assertEqual(srcset, f"/assets/{small[1]} 64w, /assets/{large[1]} 128w")
+
+    def test_build_missing_vendor(self):
+        """Are the bundles of missing vendored files skipped, not the build?"""
+
+        dist = tempfile.mkdtemp()
+        bundles = {'vendor.js': ('vendor/missing.js',), **BUNDLES}
+
+        with patch.object(assets, 'DIST_DIR', dist), \
+                patch.object(assets, 'MANIFEST', os.path.join(dist, 'manifest.json')), \
+                patch.object(assets, 'BUNDLES', bundles):
+            manifest = assets.build()
+
+            self.assertEqual(manifest['skipped'], {'vendor.js': ['vendor/missing.js']})
+            self.assertNotIn('vendor.js', manifest['files'])
+            self.assertIn('app.js', manifest['files'])
+            self.assertIn(BACKGROUND, manifest['srcsets'])
+
+            # OUR OWN FILES MUST BE THERE
+            with patch.object(assets, 'BUNDLES', {'app.js': ('scripts/missing.js',)}):
+                with self.assertRaises(FileNotFoundError):
+                    assets.build()
+
+        shutil.rmtree(dist, ignore_errors=True)
+
+    def test_template_fallback(self):
+        """Does a page link the sources of the bundles that aren't built?"""
+
+        with self.app.test_request_context():
+            html = render_template_string(
+                "{{ asset_built('app.js') }}|{{ asset_built('vendor.js') }}")
+
+        self.assertEqual(html, "True|False")
@@ -0,0 +1,92 @@
+"""Metrics tests"""
+
+# run like:
+#
+#   FLASK_ENV=production python -m unittest -v test_metrics.py
+
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from metrics import pool_options, MeteredQueuePool, MeteredNullPool
+from app import app
+
+
+class PoolOptionsTestCase(TestCase):
+    """Test the connection pool settings from the environment"""
+
+    def test_pool_defaults(self):
+        """Is a metered QueuePool used without any env vars?"""
+
+        options = pool_options({})
+
+        self.assertIs(options['poolclass'], MeteredQueuePool)
+        self.assertEqual(options['pool_size'], 5)
+        self.assertEqual(options['max_overflow'], 10)
+        self.assertTrue(options['pool_pre_ping'])
+
+    def test_pool_env(self):
+        """Are the DB_POOL_* env vars parsed?"""
+
+        options = pool_options({"DB_POOL_SIZE": "3",
+                                "DB_MAX_OVERFLOW": "0",
+                                "DB_POOL_TIMEOUT": "2.5",
+                                "DB_POOL_RECYCLE": "600",
+                                "DB_POOL_PRE_PING": "0"})
+
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_timeout'], 2.5)
+        self.assertEqual(options['pool_recycle'], 600)
+        self.assertFalse(options['pool_pre_ping'])
+
+    def test_pool_pgbouncer(self):
+        """Does DB_PGBOUNCER=1 leave the pooling to PgBouncer?"""
+
+        self.assertEqual(pool_options({"DB_PGBOUNCER": "1", "DB_POOL_SIZE": "3"}),
+                         {"poolclass": MeteredNullPool})
+
+
+class MetricsViewTestCase(TestCase):
+    """Test the /metrics endpoint"""
+
+    def setUp(self):
+
+        self.client = app.test_client()
+        self.token = app.config.get("METRICS_TOKEN")
+        app.config["METRICS_TOKEN"] = "s3cret"
+
+    def tearDown(self):
+
+        app.config["METRICS_TOKEN"] = self.token
+
+    def test_metrics_token(self):
+        """Are the metrics hidden without the token?"""
+
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+
+        resp = self.client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+        self.assertEqual(resp.status_code, 403)
+
+        resp = self.client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/plain")
+
+    def test_metrics_pool_gauges(self):
+        """Are the checkouts & the gauges of a metered pool shown?"""
+
+        engine = create_engine("sqlite://", poolclass=MeteredQueuePool,
+                               pool_size=2, pool_logging_name="test_pool")
+
+        with engine.connect():
+            resp = self.client.get("/metrics", headers={"Authorization": "Bearer s3cret"})
+
+        text = resp.get_data(as_text=True)
+
+        self.assertIn('db_pool_size{pool="test_pool"} 2', text)
+        self.assertIn('db_pool_checked_out{pool="test_pool"} 1', text)
+        self.assertIn('db_pool_overflow{pool="test_pool"} 0', text)
+        self.assertIn('db_pool_checkouts_total{pool="test_pool"} 1', text)
+        self.assertIn('db_pool_checkout_seconds_count{pool="test_pool"} 1', text)
+
+        engine.dispose()
@@ -5,14 +5,21 @@
 #     python -m unittest -v test_user_model.py
 
 import os
+import json
+import tempfile
+from datetime import date, timedelta
 from unittest import TestCase, expectedFailure
+from unittest.mock import patch
 
-from models import db, User, Food, FoodLog, FoodServing
+from models import (db, User, Food, FoodLog, FoodServing, UserFood, DailyTotal, Job,
+                    add_months, month_start, partition_ranges, ensure_food_log_partitions)
 
 os.environ['DATABASE_URL'] = "postgresql:///calorie_db_test"
 # os.environ['HEROKU_POSTGRESQL_IVORY_URL'] = "postgresql:///calorie_db_test"
 
 from app import app
+from exporter import columnar_export
+from jobs import revalidate_foods
 
 # Make Flask errors be real errors, not HTML pages with error info
 app.config['TESTING'] = True
@@ -179,3 +186,435 @@ class UserModelTestCase(TestCase):
                                       password="wrong_password")
 
         self.assertNotEqual(user, wrong_pass)
+
+
+TEST_FOOD = {
+    "food_id": "35718",
+    "food_name": "Apples",
+    "food_type": "Generic",
+    "food_url": "https://www.fatsecret.com/calories-nutrition/usda/apples",
+    "servings": {
+        "serving": [
+            {
+                "serving_id": "32915",
+                "serving_description": "100 g",
+                "measurement_description": "g",
+                "metric_serving_amount": "100.000",
+                "metric_serving_unit": "g",
+                "number_of_units": "100.000",
+                "calories": "52",
+                "carbohydrate": "13.81",
+                "fat": "0.17",
+                "protein": "0.26",
+            },
+            {
+                "serving_id": "34128",
+                "serving_description": "1 medium (3\" dia)",
+                "measurement_description": "medium (3\" dia)",
+                "metric_serving_amount": "182.000",
+                "metric_serving_unit": "g",
+                "number_of_units": "1.000",
+                "calories": "95",
+                "carbohydrate": "25.13",
+                "fat": "0.31",
+                "protein": "0.47",
+            },
+        ]
+    }
+}
+
+
+class FoodModelTestCase(TestCase):
+    """Test models for foods & food logs"""
+
+    def setUp(self):
+        """Clean up the food tables"""
+
+        FoodLog.query.delete()
+        FoodServing.query.delete()
+        Food.query.delete()
+        User.query.delete()
+
+        self.user = User(**TEST_USER_1)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transaction"""
+
+        db.session.rollback()
+
+    def test_food_upsert(self):
+        """Does upsert save the food & its servings only once?"""
+
+        Food.upsert(TEST_FOOD)
+        Food.upsert(TEST_FOOD)
+        db.session.commit()
+
+        self.assertEqual(Food.query.count(), 1)
+        self.assertEqual(FoodServing.query.count(), 2)
+
+    def test_food_upsert_same_name(self):
+        """Is a new food named like another one saved under a unique name?"""
+
+        other = {**TEST_FOOD, "food_id": "35719",
+                 "servings": {"serving": [{**TEST_FOOD['servings']['serving'][0],
+                                           "serving_id": "32916"}]}}
+
+        Food.upsert(TEST_FOOD)
+        Food.upsert(other)
+        Food.upsert(other)
+        db.session.commit()
+
+        self.assertEqual(Food.query.get(35718).name, "Apples")
+        self.assertEqual(Food.query.get(35719).name, "Apples #35719")
+        self.assertEqual(FoodServing.query.count(), 3)
+
+    def test_food_revalidate(self):
+        """Does revalidate update only the changed servings?"""
+
+        Food.upsert(TEST_FOOD)
+        db.session.commit()
+
+        self.assertEqual(Food.revalidate(TEST_FOOD), 0)
+
+        changed = json.loads(json.dumps(TEST_FOOD))
+        changed['servings']['serving'][1]['calories'] = "96"
+        changed['servings']['serving'].append({**changed['servings']['serving'][0],
+                                               "serving_id": "99999",
+                                               "serving_description": "1 cup"})
+
+        self.assertEqual(Food.revalidate(changed), 2)
+        db.session.commit()
+
+        self.assertEqual(FoodServing.query.get(34128).calories, 96)
+        self.assertEqual(FoodServing.query.count(), 3)
+
+    def test_revalidate_foods_name_clash(self):
+        """Does a food renamed to another food's name get its id in its name?"""
+
+        pears = {**TEST_FOOD, "food_id": "35719", "food_name": "Pears",
+                 "servings": {"serving": [{**TEST_FOOD['servings']['serving'][0],
+                                           "serving_id": "32916"}]}}
+        Food.upsert(TEST_FOOD)
+        Food.upsert(pears)
+        db.session.commit()
+
+        refreshed_at = Food.query.get(35719).refreshed_at
+        renamed = {**pears, "food_name": "Apples"}
+        foods = {35718: TEST_FOOD, 35719: renamed}
+
+        with patch("jobs.fatsecret") as fatsecret:
+            fatsecret.return_value.food_get.side_effect = foods.get
+            revalidate_foods({'pause': 0})
+
+        db.session.expire_all()
+        pear = Food.query.get(35719)
+
+        self.assertEqual(pear.name, "Apples #35719")
+        self.assertGreater(pear.refreshed_at, refreshed_at)
+        self.assertTrue(Food.query.get(35718).is_fresh(timedelta(minutes=1)))
+
+        payload = Food.query.get(35718).to_payload()
+
+        self.assertEqual(payload['food_name'], "Apples")
+        self.assertIn("32915", [s['serving_id'] for s in payload['servings']['serving']])
+
+    def test_foodlog_from_serving(self):
+        """Does the food log calculate its calories?"""
+
+        Food.upsert(TEST_FOOD)
+        serving = TEST_FOOD['servings']['serving'][0]
+
+        log = FoodLog.from_serving(user_id=self.user.id,
+                                   food_id=35718,
+                                   serving=serving,
+                                   amount=150,
+                                   the_date="2022-01-05")
+        db.session.add(log)
+        db.session.commit()
+
+        self.assertEqual(log.calories, 78)
+        self.assertEqual(log.serving_id, 32915)
+
+    def test_food_search(self):
+        """Does the local search find foods by word prefix?"""
+
+        Food.upsert(TEST_FOOD)
+        db.session.commit()
+
+        results, last_page = Food.search("appl")
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(last_page)
+        self.assertEqual(results[0]['food_name'], "Apples")
+        self.assertIn("Per 100 g - Calories: 52kcal", results[0]['food_description'])
+
+        self.assertEqual(Food.search("pizza"), ([], True))
+
+    def test_user_foods_trigger(self):
+        """Are logged foods indexed for the "my foods" search?"""
+
+        Food.upsert(TEST_FOOD)
+        serving = TEST_FOOD['servings']['serving'][1]
+
+        for amount in (1, 2):
+            db.session.add(FoodLog.from_serving(user_id=self.user.id,
+                                                food_id=35718,
+                                                serving=serving,
+                                                amount=amount,
+                                                the_date="2022-01-05"))
+            db.session.commit()
+
+        user_food = UserFood.query.get((self.user.id, 35718))
+
+        self.assertEqual(user_food.log_count, 2)
+        self.assertEqual(user_food.last_amount, 2)
+        self.assertEqual(user_food.last_serving_id, 34128)
+
+        results, last_page = UserFood.search(self.user.id, "ppl")
+
+        self.assertEqual([r['food_name'] for r in results], ["Apples"])
+        self.assertEqual(UserFood.search(self.user.id, "pear"), ([], True))
+
+    def test_user_foods_trigger_edits_deletes(self):
+        """Do edited & deleted logs change the user's food, down to none?"""
+
+        Food.upsert(TEST_FOOD)
+        serving = TEST_FOOD['servings']['serving'][0]
+
+        logs = [FoodLog.from_serving(user_id=self.user.id,
+                                     food_id=35718,
+                                     serving=serving,
+                                     amount=amount,
+                                     the_date=the_date)
+                for amount, the_date in ((100, "2022-01-05"), (150, "2022-01-09"))]
+        db.session.add_all(logs)
+        db.session.commit()
+        first, last = [log.id for log in logs]
+
+        FoodLog.update_amounts(self.user.id, {last: 200})
+        db.session.commit()
+
+        self.assertEqual(UserFood.query.get((self.user.id, 35718)).last_amount, 200)
+
+        FoodLog.delete_many(self.user.id, [last])
+        db.session.commit()
+        db.session.expire_all()
+
+        user_food = UserFood.query.get((self.user.id, 35718))
+
+        self.assertEqual(user_food.log_count, 1)
+        self.assertEqual(user_food.last_logged, date(2022, 1, 5))
+        self.assertEqual(user_food.last_amount, 100)
+
+        FoodLog.delete_many(self.user.id, [first])
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertIsNone(UserFood.query.get((self.user.id, 35718)))
+
+    def test_refresh_popularity(self):
+        """Is the popularity recounted from the logs, not from each log?"""
+
+        Food.upsert(TEST_FOOD)
+        serving = TEST_FOOD['servings']['serving'][0]
+
+        db.session.add_all([FoodLog.from_serving(user_id=self.user.id,
+                                                 food_id=35718,
+                                                 serving=serving,
+                                                 amount=amount,
+                                                 the_date="2022-01-05") for amount in (100, 150)])
+        db.session.commit()
+
+        self.assertEqual(Food.query.get(35718).popularity, 0)
+
+        self.assertEqual(Food.refresh_popularity(), 1)
+        db.session.commit()
+
+        self.assertEqual(Food.query.get(35718).popularity, 2)
+        self.assertEqual(Food.refresh_popularity(), 0)
+
+    def test_columnar_export(self):
+        """Are the logs written to one Parquet / Feather file per month?"""
+
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+
+        Food.upsert(TEST_FOOD)
+        serving = TEST_FOOD['servings']['serving'][0]
+
+        db.session.add_all([FoodLog.from_serving(user_id=self.user.id,
+                                                 food_id=35718,
+                                                 serving=serving,
+                                                 amount=amount,
+                                                 the_date=the_date)
+                            for amount, the_date in ((150, "2022-01-05"),
+                                                     (100, "2022-01-20"),
+                                                     (50, "2022-02-01"))])
+        db.session.commit()
+
+        for fmt, read in (('parquet', pq.read_table), ('arrow', feather.read_table)):
+            with tempfile.TemporaryDirectory() as out_dir:
+                self.assertEqual(columnar_export(out_dir, fmt=fmt, user_id=self.user.id), 3)
+                self.assertEqual(sorted(os.listdir(out_dir)), ["month=2022-01", "month=2022-02"])
+
+                table = read(os.path.join(out_dir, "month=2022-01", f"part-00000.{fmt}"))
+
+            self.assertEqual(table.num_rows, 2)
+            self.assertEqual(table.column_names[:5], ['log_id', 'user_id', 'date', 'food_id', 'food'])
+            self.assertIn('vitamin_c', table.column_names)
+
+            rows = table.to_pylist()
+
+            self.assertEqual([row['date'] for row in rows], [date(2022, 1, 5), date(2022, 1, 20)])
+            self.assertEqual(rows[0]['food'], "Apples")
+            self.assertEqual(rows[0]['serving'], "100 g")
+            self.assertAlmostEqual(rows[0]['calories'], 78)
+            self.assertAlmostEqual(rows[0]['carbohydrate'], 13.81 * 1.5)
+
+    def test_daily_totals_trigger(self):
+        """Do the daily totals follow added, changed & deleted logs?"""
+
+        Food.upsert(TEST_FOOD)
+        serving = TEST_FOOD['servings']['serving'][0]
+
+        logs = [FoodLog.from_serving(user_id=self.user.id,
+                                     food_id=35718,
+                                     serving=serving,
+                                     amount=amount,
+                                     the_date="2022-01-05") for amount in (100, 150)]
+        db.session.add_all(logs)
+        db.session.commit()
+
+        total = DailyTotal.query.get((self.user.id, date(2022, 1, 5)))
+        version = total.version
+
+        self.assertEqual((round(total.calories), total.entries), (130, 2))
+
+        FoodLog.update_amounts(self.user.id, {logs[0].id: 200})
+        db.session.commit()
+        db.session.refresh(total)
+
+        self.assertEqual((round(total.calories), total.entries), (182, 2))
+        self.assertGreater(total.version, version)
+
+        FoodLog.delete_many(self.user.id, [log.id for log in logs])
+        db.session.commit()
+        db.session.refresh(total)
+
+        self.assertEqual((total.calories, total.entries), (0, 0))
+        self.assertEqual(list(DailyTotal.for_range(self.user.id, date(2022, 1, 1),
+                                                   date(2022, 1, 31))), [date(2022, 1, 5)])
+
+
+class JobModelTestCase(TestCase):
+    """Test models for background jobs"""
+
+    def setUp(self):
+        """Clean up the jobs table"""
+
+        Job.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up fouled transaction"""
+
+        db.session.rollback()
+
+    def test_job_enqueue_once(self):
+        """Is a job with the same key queued only once?"""
+
+        Job.enqueue('ingest_food', {'food_id': 35718}, key="ingest_food:35718")
+        Job.enqueue('ingest_food', {'food_id': 35718}, key="ingest_food:35718")
+        db.session.commit()
+
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_job_claim_and_retry(self):
+        """Is a claimed job hidden from other workers & retried later on failure?"""
+
+        Job.enqueue('refresh_popularity', max_attempts=2)
+        db.session.commit()
+
+        job = Job.claim(timeout=60)
+
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(Job.claim(timeout=60))
+
+        job.fail("boom", backoff=60)
+        db.session.commit()
+
+        self.assertEqual(job.status, 'queued')
+        self.assertIsNone(Job.claim(timeout=60))    # NOT DUE YET
+
+        job.attempts = 2
+        job.fail("boom", backoff=60)
+        db.session.commit()
+
+        self.assertEqual(job.status, 'failed')
+
+
+class PartitionTestCase(TestCase):
+    """Test the monthly partitions of food_logs"""
+
+    def test_add_months(self):
+        """Is the first day of a later or earlier month found across years?"""
+
+        self.assertEqual(month_start(date(2022, 1, 31)), date(2022, 1, 1))
+        self.assertEqual(add_months(date(2022, 1, 31), 1), date(2022, 2, 1))
+        self.assertEqual(add_months(date(2022, 12, 15), 1), date(2023, 1, 1))
+        self.assertEqual(add_months(date(2022, 1, 15), -1), date(2021, 12, 1))
+        self.assertEqual(add_months(date(2022, 3, 1), 12), date(2023, 3, 1))
+        self.assertEqual(add_months(date(2022, 3, 1), -15), date(2020, 12, 1))
+        self.assertEqual(add_months(date(2022, 3, 9), 0), date(2022, 3, 1))
+
+    def test_partition_ranges(self):
+        """Are the partitions named by month & bounded by whole months?"""
+
+        ranges = list(partition_ranges(date(2022, 11, 15), date(2023, 1, 3)))
+
+        self.assertEqual(ranges, [
+            ("food_logs_2022_11", date(2022, 11, 1), date(2022, 12, 1)),
+            ("food_logs_2022_12", date(2022, 12, 1), date(2023, 1, 1)),
+            ("food_logs_2023_01", date(2023, 1, 1), date(2023, 2, 1)),
+        ])
+
+        self.assertEqual(len(list(partition_ranges(date(2022, 5, 31), date(2022, 5, 1)))), 1)
+        self.assertEqual(list(partition_ranges(date(2022, 6, 1), date(2022, 5, 1))), [])
+
+    def test_ensure_partitions(self):
+        """Are missing partitions created once & attached with their range?"""
+
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+
+            created = ensure_food_log_partitions(connection, first=date(2030, 1, 20),
+                                                 last=date(2030, 2, 1))
+
+            self.assertEqual(created, ["food_logs_2030_01", "food_logs_2030_02"])
+            self.assertEqual(ensure_food_log_partitions(connection, first=date(2030, 1, 1),
+                                                        last=date(2030, 2, 1)), [])
+
+            bound = connection.execute(db.text(
+                "SELECT pg_get_expr(relpartbound, oid) FROM pg_class "
+                "WHERE relname = 'food_logs_2030_01'")).scalar()
+
+            self.assertEqual(bound, "FOR VALUES FROM ('2030-01-01') TO ('2030-02-01')")
+
+            transaction.rollback()
+
+    def test_ensure_partitions_of_dates(self):
+        """Are only the months of the given dates created, not those between?"""
+
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+
+            created = ensure_food_log_partitions(connection, dates=[date(2031, 5, 2),
+                                                                    date(2033, 1, 9),
+                                                                    date(2031, 5, 30)])
+
+            self.assertEqual(created, ["food_logs_2031_05", "food_logs_2033_01"])
+
+            transaction.rollback()
@@ -4,16 +4,65 @@
 #
 #   FLASK_ENV=production python -m unittest -v test_views.py
 
+import copy
+import gzip
+import io
 import os
-from datetime import date
+import time
+from datetime import date, datetime
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, connect_db, User, Food, FoodLog, FoodServing, apple
+from flask import g
+from sqlalchemy import event
+
+from models import db, connect_db, User, Food, FoodLog, FoodServing, Job, REPLICA_BIND
 
 os.environ['DATABASE_URL'] = "postgresql:///calorie_db_test"
 # os.environ['HEROKU_POSTGRESQL_IVORY_URL'] = "postgresql:///calorie_db_test"
 
-from app import app, FOOD_KEY, CURR_USER_KEY, DATE_KEY, yaz, print_
+from app import (app, create_app, FOOD_KEY, CART_KEY, CURR_USER_KEY, DATE_KEY, LAST_WRITE_KEY,
+                 search_cache, yaz, print_)
+
+# A FATSECRET food_get RESULT
+apple = {
+    "food_id": "35718",
+    "food_name": "Apples",
+    "food_type": "Generic",
+    "food_url": "https://www.fatsecret.com/calories-nutrition/usda/apples",
+    "servings": {
+        "serving": [
+            {
+                "serving_id": "32915",
+                "serving_description": "100 g",
+                "measurement_description": "g",
+                "metric_serving_amount": "100.000",
+                "metric_serving_unit": "g",
+                "number_of_units": "100.000",
+                "calories": "52",
+                "carbohydrate": "13.81",
+                "fat": "0.17",
+                "protein": "0.26",
+                "fiber": "2.4",
+                "sugar": "10.39",
+            },
+            {
+                "serving_id": "34128",
+                "serving_description": "1 medium (3\" dia)",
+                "measurement_description": "medium (3\" dia)",
+                "metric_serving_amount": "182.000",
+                "metric_serving_unit": "g",
+                "number_of_units": "1.000",
+                "calories": "95",
+                "carbohydrate": "25.13",
+                "fat": "0.31",
+                "protein": "0.47",
+                "fiber": "4.4",
+                "sugar": "18.91",
+            },
+        ]
+    }
+}
 
 # Make Flask errors be real errors, not HTML pages with error info
 app.config['TESTING'] = True
@@ -49,11 +98,12 @@ class UserViewTestCase(TestCase):
         self.testuser.id = self.testuser_id
 
         # TEST FOOD
-        self.apple = apple
+        # A COPY, make_a_foodlog CHANGES THE SERVING
+        self.apple = copy.deepcopy(apple)
         self.food_id = int(apple['food_id'])
         # self.food_id = apple['food_id']
         self.food_name = apple['food_name']
-        self.serving = [s for s in apple['servings']['serving'] if s['measurement_description'] == 'g'][0]
+        self.serving = [s for s in self.apple['servings']['serving'] if s['measurement_description'] == 'g'][0]
         self.serving_id = int(self.serving['serving_id'])
         # self.serving_id = self.serving['serving_id']
 
@@ -70,7 +120,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -85,6 +135,29 @@ class UserViewTestCase(TestCase):
             self.assertIn(self.food_name, html)
 
 
+    # ADD FOOD PAGE
+    def test_food_add_page_catalog(self):
+        """Is a new food saved on its first view & a fresh one read locally?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            with patch("app.get_fatsecret") as get_fatsecret:
+                get_fatsecret.return_value.food_get.return_value = self.apple
+
+                resp = c.get(f"/food/add/{self.food_id}")
+                self.assertEqual(resp.status_code, 200)
+
+                resp = c.get(f"/food/add/{self.food_id}")
+                self.assertEqual(resp.status_code, 200)
+
+            self.assertEqual(get_fatsecret.return_value.food_get.call_count, 1)
+            self.assertIsNotNone(Food.query.get(self.food_id))
+            self.assertEqual(Job.query.count(), 0)
+
+
     # ADD FOOD - ANONYMOUS
     def test_food_add_anonymous(self):
         """Is anonymous user prevented from adding foodlogs?"""
@@ -104,7 +177,7 @@ class UserViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Get Ready to Get In Shape!", html)
+            self.assertIn("Welcome back.", html)
                
 
     # EDIT FOOD PREP
@@ -133,7 +206,7 @@ class UserViewTestCase(TestCase):
         calories = unit_calories * amount / number_of_units
 
         self.food_log = FoodLog(
-            user_id=self.testuser.id,
+            user_id=self.testuser_id,
             food_id=self.food_id,
             serving_id=food_serving.serving_id,
             serving_description=food_serving.serving_description,
@@ -153,7 +226,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -175,7 +248,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -194,7 +267,7 @@ class UserViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Get Ready to Get In Shape!", html)
+            self.assertIn("Welcome back.", html)
 
 
     # EDIT FOOD - NOT AUTHORIZED
@@ -203,7 +276,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -222,7 +295,7 @@ class UserViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Get Ready to Get In Shape!", html)
+            self.assertIn("Welcome back.", html)
 
 
     # DELETE FOOD
@@ -231,7 +304,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -252,7 +325,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -270,7 +343,7 @@ class UserViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Get Ready to Get In Shape!", html)
+            self.assertIn("Welcome back.", html)
 
 
     # DELETE FOOD - NOT AUTHORIZED
@@ -279,7 +352,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
@@ -297,7 +370,7 @@ class UserViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Get Ready to Get In Shape!", html)
+            self.assertIn("Welcome back.", html)
 
     
     # SEARCH FOOD (CONNECTS TO API?)
@@ -306,13 +379,23 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 # sess[FOOD_KEY] = apple
                 sess[DATE_KEY] = date.today().isoformat()
 
-            resp = c.post(f"/food/search",
-                        data={"food": apple},
-                        follow_redirects=True)
+            # NO NETWORK IN TESTS, FATSECRET ANSWERS WITH THE APPLE
+            result = {"food_id": apple['food_id'],
+                      "food_name": apple['food_name'],
+                      "food_type": apple['food_type'],
+                      "food_url": apple['food_url'],
+                      "food_description": "Per 100g - Calories: 52kcal"}
+
+            with patch("app.get_fatsecret") as get_fatsecret:
+                get_fatsecret.return_value.foods_search.return_value = [result]
+
+                resp = c.post(f"/food/search",
+                            data={"food": self.food_name},
+                            follow_redirects=True)
             
             html = resp.get_data(as_text=True)
 
@@ -327,7 +410,7 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+                sess[CURR_USER_KEY] = self.testuser_id
                 sess[DATE_KEY] = date.today().isoformat()
 
             resp = c.post(f"/calendar",
@@ -336,9 +419,745 @@ class UserViewTestCase(TestCase):
             
             html = resp.get_data(as_text=True)
             
-            html_part = '<h3>\n    The List of \n    January     \n    \n      5<sup>th</sup>\n    \n    2022 / Wednesday\n  </h3>'
+            html_part = '<h3>\n    The List of \n    <span id="day-title">\n    January     \n    \n      5<sup>th</sup>\n    \n    2022 / Wednesday\n    </span>\n  </h3>'
 
             self.assertEqual(resp.status_code, 200)
             self.assertIn(html_part, html)
 
 
+
+
+    # IMPORT FOOD LOGS
+    def test_food_import(self):
+        """Can we bulk import food logs?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            csv_file = (f"date,food_id,serving_id,amount\n"
+                        f"2021-03-04,{self.food_id},{self.serving_id},120\n"
+                        f"2021-03-05,{self.food_id},{self.serving_id},80\n"
+                        f"2021-03-06,123456789,,80\n")
+
+            resp = c.post("/food/import",
+                          data={"file": (io.BytesIO(csv_file.encode()), "logs.csv")},
+                          content_type="multipart/form-data",
+                          follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("2 food logs imported, 1 rows skipped.", html)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 3)
+
+
+    def test_food_import_bad_rows(self):
+        """Are malformed JSON lines & servings without a description skipped?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            FoodServing.query.get(self.serving_id).serving_description = ""
+            db.session.commit()
+
+            jsonl_file = (f'{{"date": "2021-03-04", "food_id": {self.food_id}, "amount": 120}}\n'
+                          f'{{"date": "2021-03-05", "food_id": \n'
+                          f'[1, 2]\n')
+
+            resp = c.post("/food/import",
+                          data={"file": (io.BytesIO(jsonl_file.encode()), "logs.jsonl")},
+                          content_type="multipart/form-data",
+                          follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("0 food logs imported, 3 rows skipped.", html)
+
+
+    def test_food_import_out_of_range(self):
+        """Are rows of far-off dates or without a positive amount skipped?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            csv_file = (f"date,food_id,serving_id,amount\n"
+                        f"9999-12-31,{self.food_id},{self.serving_id},120\n"
+                        f"1800-01-01,{self.food_id},{self.serving_id},120\n"
+                        f"2021-03-04,{self.food_id},{self.serving_id},0\n"
+                        f"2021-03-04,{self.food_id},{self.serving_id},-80\n"
+                        f"2021-03-04,{self.food_id},{self.serving_id},80\n")
+
+            resp = c.post("/food/import",
+                          data={"file": (io.BytesIO(csv_file.encode()), "logs.csv")},
+                          content_type="multipart/form-data",
+                          follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("1 food logs imported, 4 rows skipped.", html)
+            self.assertIsNone(db.session.execute(
+                db.text("SELECT to_regclass('food_logs_9999_12')")).scalar())
+
+
+    def test_food_import_too_large(self):
+        """Is an upload over the size limit refused?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            limit = app.config["MAX_CONTENT_LENGTH"]
+            app.config["MAX_CONTENT_LENGTH"] = 1024 * 1024
+
+            try:
+                resp = c.post("/food/import",
+                              data={"file": (io.BytesIO(b"x" * 2 * 1024 * 1024), "logs.csv")},
+                              content_type="multipart/form-data",
+                              follow_redirects=True)
+            finally:
+                app.config["MAX_CONTENT_LENGTH"] = limit
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("The file is too large, the limit is 1 MB.", resp.get_data(as_text=True))
+
+
+    # EXPORT FOOD LOGS
+    def test_food_export(self):
+        """Can we export our food logs?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            resp = c.get("/food/export/csv")
+            csv_text = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(csv_text.startswith("date,food,brand,serving,amount"))
+            self.assertIn(self.food_name, csv_text)
+
+            resp = c.get("/food/export/ndjson")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'"food": "{self.food_name}"', resp.get_data(as_text=True))
+
+
+    # QUICK ADD FROM FREQUENT FOODS
+    def test_food_quick_add(self):
+        """Can we log a frequent food without the API?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            resp = c.get("/food/frequent")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'action="/food/quick-add/{self.food_id}"', html)
+            self.assertIn('value="85.0"', html)
+
+            resp = c.post(f"/food/quick-add/{self.food_id}",
+                          data={"amount": 50, "serving_id": self.serving_id},
+                          follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 2)
+
+
+    # COPY A DAY
+    def test_food_copy(self):
+        """Can we copy a day's logs to another date?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            resp = c.post("/food/copy",
+                          data={"from_date": date.today().isoformat(),
+                                "to_date": "2022-01-05"},
+                          follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("1 food logs copied to January 05, 2022.", html)
+
+            copied = FoodLog.query.filter_by(user_id=self.testuser_id,
+                                             date=date(2022, 1, 5)).one()
+
+            self.assertEqual(copied.amount, 85)
+            self.assertEqual(copied.food_id, self.food_id)
+
+            resp = c.post("/food/copy",
+                          data={"to_date": "2022-01-06", "log_ids": "x"})
+
+            self.assertEqual(resp.status_code, 400)
+
+
+    # CART
+    def test_food_cart(self):
+        """Can we log the foods of the cart together?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            with c.session_transaction() as sess:
+                sess[CART_KEY] = [
+                    {"food_id": self.food_id, "serving_id": self.serving_id,
+                     "amount": 50, "food_name": "Apples", "serving_description": "100 g"},
+                    {"food_id": self.food_id, "serving_id": self.serving_id,
+                     "amount": 20, "food_name": "Apples", "serving_description": "100 g"},
+                ]
+
+            resp = c.get("/cart")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('name="amount-1"', html)
+
+            # A BAD AMOUNT LOGS NOTHING
+            for amount in ("x", 0, -30):
+                resp = c.post("/cart/commit", data={"amount-1": amount})
+
+                self.assertEqual(resp.status_code, 400)
+                self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 1)
+
+            resp = c.post("/cart/commit", data={"amount-1": 30}, follow_redirects=True)
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("2 foods logged.", html)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 3)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id, amount=30).count(), 1)
+
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[CART_KEY], [])
+
+
+    def test_food_cart_fetches_missing_foods(self):
+        """Are cart foods missing from the catalog fetched from Fatsecret?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+                sess[CART_KEY] = [
+                    {"food_id": self.food_id, "serving_id": self.serving_id,
+                     "amount": 50, "food_name": "Apples", "serving_description": "100 g"},
+                ]
+
+            with patch("app.new_fatsecret") as new_fatsecret:
+                new_fatsecret.return_value.food_get.return_value = self.apple
+
+                resp = c.post("/cart/commit", follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+
+            new_fatsecret.return_value.food_get.assert_called_once_with(self.food_id)
+            self.assertIn("1 foods logged.", html)
+            self.assertEqual(Food.query.count(), 1)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 1)
+
+
+    def test_food_cart_keeps_unknown_servings(self):
+        """Are cart items with an unknown serving kept in the cart?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            lost = {"food_id": self.food_id, "serving_id": 1,
+                    "amount": 20, "food_name": "Apples", "serving_description": "1 cup"}
+
+            with c.session_transaction() as sess:
+                sess[CART_KEY] = [
+                    {"food_id": self.food_id, "serving_id": self.serving_id,
+                     "amount": 50, "food_name": "Apples", "serving_description": "100 g"},
+                    lost,
+                ]
+
+            with patch("app.new_fatsecret") as new_fatsecret:
+                new_fatsecret.return_value.food_get.return_value = self.apple
+
+                resp = c.post("/cart/commit", follow_redirects=True)
+
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("1 foods logged.", html)
+            self.assertIn("1 foods could not be logged", html)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 2)
+
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[CART_KEY], [lost])
+
+
+    # BATCH EDIT & DELETE
+    def test_food_batch_edit_delete(self):
+        """Can we change & delete many logs at once, only our own?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+            log_id = self.food_log.id
+
+            resp = c.post("/food/batch-edit",
+                          data={f"amount-{log_id}": 170},
+                          follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("1 food logs updated.", resp.get_data(as_text=True))
+
+            log = FoodLog.query.get(log_id)
+            self.assertEqual(log.amount, 170)
+            self.assertAlmostEqual(log.calories,
+                                   log.unit_calories * 170 / log.number_of_units, places=1)
+
+            # A ZERO OR NEGATIVE AMOUNT CHANGES NOTHING
+            for amount in (0, -10):
+                resp = c.post("/food/batch-edit", data={f"amount-{log_id}": amount})
+
+                self.assertEqual(resp.status_code, 400)
+                self.assertEqual(FoodLog.query.get(log_id).amount, 170)
+
+            # A LOG WHICH IS NOT OURS ABORTS THE WHOLE BATCH
+            resp = c.post("/food/batch-delete", data={"log_ids": [log_id, log_id + 1000]})
+
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 1)
+
+            resp = c.post("/food/batch-delete", data={"log_ids": [log_id]},
+                          follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(FoodLog.query.filter_by(user_id=self.testuser_id).count(), 0)
+
+
+    # JSON API
+    def test_api_day_and_logs(self):
+        """Can we read a day & create, change and delete logs as JSON?"""
+
+        with self.client as c:
+            resp = c.get(f"/api/v1/days/{date.today().isoformat()}")
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            # A FRESH LOCAL FOOD NEEDS NO API CALL
+            Food.query.get(self.food_id).refreshed_at = datetime.utcnow()
+            db.session.commit()
+
+            resp = c.get(f"/api/v1/days/{date.today().isoformat()}")
+            data = resp.get_json()
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(data['logs']), 1)
+            self.assertEqual(data['logs'][0]['amount'], 85)
+
+            resp = c.post("/api/v1/logs", json={"food_id": self.food_id,
+                                                "serving_id": self.serving_id,
+                                                "amount": 40})
+            data = resp.get_json()
+
+            self.assertEqual(resp.status_code, 201)
+            self.assertEqual(len(data['day']['logs']), 2)
+            log_id = data['log']['id']
+
+            resp = c.patch(f"/api/v1/logs/{log_id}", json={"amount": 80})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()['log']['amount'], 80)
+
+            resp = c.delete(f"/api/v1/logs/{log_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(resp.get_json()['day']['logs']), 1)
+            self.assertEqual(c.delete(f"/api/v1/logs/{log_id}").status_code, 404)
+
+
+    # DAY BY URL
+    def test_day_page(self):
+        """Does /day/<date> show that day & choose it for adding foods?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            resp = c.get("/day/2022-01-05")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('data-date="2022-01-05"', html)
+            self.assertIn('href="/day/2022-01-06"', html)
+
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[DATE_KEY], "2022-01-05")
+
+            resp = c.put("/api/v1/date", json={"date": "2022-01-07"})
+
+            self.assertEqual(resp.status_code, 204)
+            with c.session_transaction() as sess:
+                self.assertEqual(sess[DATE_KEY], "2022-01-07")
+                # A NEW DATE WRITES NOTHING: THE READS STAY ON THE REPLICA
+                self.assertNotIn(LAST_WRITE_KEY, sess)
+
+
+    # WEEK VIEW
+    def test_week_page(self):
+        """Does the week view show every day with its subtotal?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            resp = c.get("/week")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(html.count('<h5 class="d-flex justify-content-between">'), 7)
+            self.assertIn(f'href="/day/{date.today().isoformat()}"', html)
+            self.assertIn("Apples", html)
+
+            resp = c.get("/week/2022-01-01?days=3")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(html.count('<h5 class="d-flex justify-content-between">'), 3)
+            self.assertNotIn("Apples", html)
+
+            # NO WEEKS WHOSE LINKS WOULD OVERFLOW
+            self.assertEqual(c.get("/week/9999-12-31").status_code, 404)
+            self.assertEqual(c.get("/week/0001-01-01").status_code, 404)
+            self.assertEqual(c.get("/day/9999-12-31").status_code, 404)
+
+
+    # MONTH CALENDAR
+    def test_month_calendar(self):
+        """Does the month calendar show & cache the daily totals?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            month = date.today().strftime("%Y-%m")
+            resp = c.get(f"/calendar/{month}")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("private", resp.headers["Cache-Control"])
+            self.assertIn(f'<a href="/day/{date.today().isoformat()}" class="d-block">', html)
+            self.assertIn('<td class="heat-', html)
+
+            resp = c.get(f"/calendar/{month}", headers={"If-None-Match": resp.headers["ETag"]})
+
+            self.assertEqual(resp.status_code, 304)
+
+            resp = c.get("/calendar/2022-13")
+
+            self.assertEqual(resp.status_code, 404)
+            self.assertEqual(c.get("/calendar/9999-12").status_code, 404)
+            self.assertEqual(c.get("/calendar/0001-01").status_code, 404)
+
+            # A DELETED USER IS SENT AWAY
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 999999
+
+            resp = c.get("/calendar")
+
+            self.assertEqual(resp.status_code, 302)
+
+
+    # CONDITIONAL REQUESTS
+    def test_home_not_modified(self):
+        """Is an unchanged day answered with 304 & a changed one rendered?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            resp = c.get("/home")
+            etag = resp.headers["ETag"]
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+
+            resp = c.get("/home", headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+
+            self.make_a_foodlog()
+
+            resp = c.get("/home", headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Apples", resp.get_data(as_text=True))
+
+            resp = c.get("/food/frequent")
+            resp = c.get("/food/frequent", headers={"If-None-Match": resp.headers["ETag"]})
+
+            self.assertEqual(resp.status_code, 304)
+
+
+    # SEARCH RESULT CACHE
+    def test_food_search_cached(self):
+        """Is a page of search results rendered once for any spelling of the term?"""
+
+        search_cache.clear()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            self.make_a_foodlog()
+
+            resp = c.get("/food/search/Apples/0?mode=local")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(search_cache), 1)
+
+            # A CHANGED CATALOG ISN'T SEEN UNTIL THE ENTRY EXPIRES
+            Food.query.get(self.food_id).name = "Green Apples"
+            db.session.commit()
+
+            resp = c.get("/food/search/%20apples/0?mode=local")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(len(search_cache), 1)
+            self.assertIn('<span class="text-primary"> apples</span>', html)
+            self.assertNotIn("Green Apples", html)
+            self.assertIn('href="/food/search/apples/-1?mode=local"', html)
+
+
+    # RESPONSE COMPRESSION
+    def test_compressed_pages(self):
+        """Are pages compressed & still answered with 304 when unchanged?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+                sess[DATE_KEY] = date.today().isoformat()
+
+            resp = c.get("/home", headers={"Accept-Encoding": "gzip"})
+            html = gzip.decompress(resp.get_data()).decode()
+
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertIn("Accept-Encoding", resp.headers["Vary"])
+            self.assertIn("</html>", html)
+            self.assertTrue(resp.headers["ETag"].startswith('W/"'))
+
+            resp = c.get("/home", headers={"Accept-Encoding": "gzip",
+                                           "If-None-Match": resp.headers["ETag"]})
+
+            self.assertEqual(resp.status_code, 304)
+
+            resp = c.get("/food/export/csv", headers={"Accept-Encoding": "gzip"})
+
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertTrue(gzip.decompress(resp.get_data()).decode().startswith("date,food,"))
+
+
+    # CONFIG PROFILES
+    def test_app_profiles(self):
+        """Has only the development profile the debug machinery?"""
+
+        try:
+            production = create_app('production')
+            development = create_app('development')
+        finally:
+            # connect_db() MADE THE LAST APP THE DEFAULT ONE OF db
+            db.app = app
+
+        self.assertFalse(production.debug)
+        self.assertNotIn('debugtoolbar', production.blueprints)
+        self.assertIn('/home', [rule.rule for rule in production.url_map.iter_rules()])
+
+        self.assertTrue(development.debug)
+        self.assertIn('debugtoolbar', development.blueprints)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test the routing of queries to the read replica"""
+
+    def setUp(self):
+        """A 'replica' bind (the test database again) & its statements"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    password="testpass123",
+                                    calorie_need=2200,
+                                    calorie_limit=1850)
+        self.testuser_id = 666
+        self.testuser.id = self.testuser_id
+        db.session.commit()
+
+        self.binds = app.config['SQLALCHEMY_BINDS']
+        app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: app.config['SQLALCHEMY_DATABASE_URI']}
+
+        self.replica = db.get_engine(app, bind=REPLICA_BIND)
+        self.statements = {'primary': [], 'replica': []}
+        self.listeners = {'primary': self.recorder('primary'),
+                          'replica': self.recorder('replica')}
+
+        event.listen(db.engine, 'before_cursor_execute', self.listeners['primary'])
+        event.listen(self.replica, 'before_cursor_execute', self.listeners['replica'])
+
+    def tearDown(self):
+
+        db.session.rollback()
+
+        event.remove(db.engine, 'before_cursor_execute', self.listeners['primary'])
+        self.replica.dispose()
+        app.extensions['sqlalchemy'].connectors.pop(REPLICA_BIND, None)
+        app.config['SQLALCHEMY_BINDS'] = self.binds
+
+    def recorder(self, name):
+        """Event listener keeping the statements sent to `name`"""
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            self.statements[name].append(statement)
+
+        return record
+
+    def reads(self, name):
+        """The SELECTs sent to `name` since the last call"""
+
+        statements, self.statements[name] = self.statements[name], []
+        return [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+
+    def login(self, last_write=0):
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+            sess[DATE_KEY] = date.today().isoformat()
+            sess[LAST_WRITE_KEY] = last_write
+
+    def test_get_bind(self):
+        """Do only the SELECTs of a replica view leave the primary?"""
+
+        select = db.select([User.id])
+        insert = db.insert(User.__table__)
+
+        with app.test_request_context():
+            self.assertIs(db.session.get_bind(clause=select), db.engine)
+
+            g.use_replica = True
+
+            self.assertIs(db.session.get_bind(clause=select), self.replica)
+            self.assertIs(db.session.get_bind(clause=insert), db.engine)
+            self.assertIs(db.session.get_bind(), db.engine)
+
+            # A FLUSH READS & WRITES ON THE PRIMARY
+            session = db.session()
+            session._flushing = True
+            try:
+                self.assertIs(session.get_bind(clause=select), db.engine)
+            finally:
+                session._flushing = False
+
+            db.session.add(Food(id=1, name="Pears", brand="Generic"))
+            db.session.flush()
+
+            self.assertTrue(any(s.startswith("INSERT INTO foods") for s in self.statements['primary']))
+            self.assertEqual(self.statements['replica'], [])
+
+            db.session.remove()
+
+    def test_replica_reads_get(self):
+        """Does a GET of a replica view read from the replica?"""
+
+        self.login()
+        self.reads('primary'), self.reads('replica')
+
+        resp = self.client.get("/home")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(any('daily_totals' in s for s in self.reads('replica')))
+        self.assertFalse(any('daily_totals' in s for s in self.reads('primary')))
+
+    def test_replica_reads_post(self):
+        """Does a POST of a replica view stay on the primary?"""
+
+        self.login()
+        self.reads('primary'), self.reads('replica')
+
+        resp = self.client.post("/calendar", data={"chosen_date": "2022-01-05"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.reads('replica'), [])
+        self.assertTrue(self.reads('primary'))
+
+    def test_replica_sticky(self):
+        """Are the reads on the primary for REPLICA_STICKY_SECONDS after a write?"""
+
+        self.login()
+
+        resp = self.client.post("/api/v1/logs", json={"food_id": 1, "serving_id": 1, "amount": 0})
+
+        self.assertEqual(resp.status_code, 400)
+
+        with self.client.session_transaction() as sess:
+            self.assertGreater(sess[LAST_WRITE_KEY], time.time() - 5)
+
+        self.reads('primary'), self.reads('replica')
+        self.client.get("/home")
+
+        self.assertEqual(self.reads('replica'), [])
+        self.assertTrue(any('daily_totals' in s for s in self.reads('primary')))
+
+        # ONCE THE WRITE IS OLD ENOUGH, BACK TO THE REPLICA
+        self.login(last_write=time.time() - app.config['REPLICA_STICKY_SECONDS'] - 1)
+        self.reads('primary'), self.reads('replica')
+        self.client.get("/home")
+
+        self.assertTrue(any('daily_totals' in s for s in self.reads('replica')))